@@ -0,0 +1,125 @@
+# admission.py (Admission Control)
+import threading
+import time
+
+
+class Rejected(Exception):
+    """A session was not admitted. ``reason`` is "user_limit" or "busy"."""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Admission:
+    """Caps concurrent sessions globally and per user, with a bounded wait queue.
+
+    A slot is held for a session's whole life, from ``acquire`` until
+    ``release`` of its key. A user at ``per_user`` slots is rejected at once,
+    since waiting would only let one client crowd out the rest. When every
+    one of the ``limit`` slots is taken, up to ``queue_size`` callers wait
+    up to their ``wait`` seconds for one to free up; anyone beyond that is
+    rejected. A ``limit`` of 0 disables the global cap. A request may bring
+    its own per-user cap (batches do), which then applies to everything
+    that user holds.
+    """
+
+    def __init__(self, limit=200, per_user=10, queue_size=50, retry_after=5):
+        self.limit = limit
+        self.per_user = per_user
+        self.queue_size = queue_size
+        self.retry_after = retry_after
+        self._users = {}      # user -> slots held
+        self._keys = {}       # session key -> user
+        self._in_flight = 0
+        self._waiting = 0
+        self._cond = threading.Condition()
+        self.admitted = 0
+        self.rejected = {"user_limit": 0, "busy": 0}
+
+    def acquire(self, user, count=1, wait=0, per_user=None):
+        """Reserve ``count`` slots for ``user``, waiting up to ``wait`` seconds. Raises Rejected."""
+        per_user = self.per_user if per_user is None else per_user
+        with self._cond:
+            if per_user and self._users.get(user, 0) + count > per_user:
+                self._reject("user_limit")
+            if not self._free(count):
+                if wait <= 0 or self._waiting >= self.queue_size:
+                    self._reject("busy")
+                deadline = time.monotonic() + wait
+                self._waiting += 1
+                try:
+                    while not self._free(count):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._reject("busy")
+                        self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+                # Another request from the same user may have been admitted meanwhile
+                if per_user and self._users.get(user, 0) + count > per_user:
+                    self._reject("user_limit")
+            self._take(user, count)
+            self.admitted += count
+
+    def bind(self, key, user):
+        """Attach one of ``user``'s acquired slots to a session key, so ``release(key)`` frees it."""
+        with self._cond:
+            if key in self._keys:
+                self._give_back(user, 1)  # the session already holds a slot
+            else:
+                self._keys[key] = user
+
+    def occupy(self, key, user):
+        """Take a slot for a session that already exists (resumed after a restart), ignoring the limits."""
+        with self._cond:
+            if key not in self._keys:
+                self._take(user, 1)
+                self._keys[key] = user
+
+    def release(self, key):
+        """Free the slot held by session ``key``. Unknown keys are ignored."""
+        with self._cond:
+            if key not in self._keys:
+                return False
+            self._give_back(self._keys.pop(key), 1)
+            return True
+
+    def cancel(self, user, count=1):
+        """Return slots acquired for sessions that were never created."""
+        with self._cond:
+            self._give_back(user, count)
+
+    def usage(self):
+        with self._cond:
+            return {
+                "in_flight": self._in_flight,
+                "limit": self.limit,
+                "waiting": self._waiting,
+                "queue_size": self.queue_size,
+                "users": len(self._users),
+                "per_user": self.per_user,
+                "admitted": self.admitted,
+                "rejected": dict(self.rejected),
+            }
+
+    def _free(self, count):
+        return not self.limit or self._in_flight + count <= self.limit
+
+    def _take(self, user, count):
+        self._in_flight += count
+        self._users[user] = self._users.get(user, 0) + count
+
+    def _give_back(self, user, count):
+        self._in_flight -= count
+        held = self._users.get(user, 0) - count
+        if held > 0:
+            self._users[user] = held
+        else:
+            self._users.pop(user, None)
+        self._cond.notify_all()
+
+    def _reject(self, reason):
+        self.rejected[reason] += 1
+        raise Rejected(reason, self.retry_after)
@@ -0,0 +1,77 @@
+# api_client.py (Bot-side API client)
+import os
+import requests
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Set API_BASE_URL only when the bot runs apart from the Flask API (split deployment)
+API_BASE_URL = os.getenv("API_BASE_URL")
+API_TIMEOUT = float(os.getenv("API_TIMEOUT", 15))
+
+
+class LocalApi:
+    """Calls the service layer directly when the bot and API share a process."""
+
+    def __init__(self):
+        # Imported here so a split deployment's bot never builds the service layer
+        import service
+        self.service = service
+
+    def generate_email(self, user=None):
+        return self.service.create_email_session(user)
+
+    def get_messages(self, temp_email, since=0):
+        return self.service.get_email_messages(temp_email, since=since)
+
+    def generate_number(self, country_id, user=None):
+        return self.service.create_number_session(country_id, user)
+
+    def check_sms(self, session_id, since=0):
+        return self.service.get_sms_status(session_id, since=since)
+
+    def cancel(self, operation_id):
+        return self.service.cancel_operation(operation_id)
+
+
+class RemoteApi:
+    """Calls the Flask API over HTTP for split deployments."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+        self.session = requests.Session()
+
+    def _call(self, method, path, **kwargs):
+        response = self.session.request(method, self.base_url + path, timeout=API_TIMEOUT, **kwargs)
+        try:
+            payload = response.json()
+        except ValueError:
+            payload = {"error": response.text}
+        return payload, response.status_code
+
+    def _client(self, user):
+        # Honoured by the API only when this host is listed in ADMISSION_TRUSTED_CLIENTS
+        return {"X-Client-Id": user} if user else {}
+
+    def generate_email(self, user=None):
+        return self._call("GET", "/generate/email", headers=self._client(user))
+
+    def get_messages(self, temp_email, since=0):
+        return self._call("GET", f"/get_messages/{temp_email}", params={"since": since})
+
+    def generate_number(self, country_id, user=None):
+        return self._call("GET", "/generate/number", params={"country_id": country_id},
+                          headers=self._client(user))
+
+    def check_sms(self, session_id, since=0):
+        return self._call("GET", f"/check_sms/{session_id}", params={"since": since})
+
+    def cancel(self, operation_id):
+        return self._call("POST", f"/cancel/{operation_id}")
+
+
+def get_api():
+    """Return the HTTP client if API_BASE_URL is set, otherwise the in-process one."""
+    if API_BASE_URL:
+        return RemoteApi(API_BASE_URL)
+    return LocalApi()
@@ -1,255 +1,256 @@
 # app.py (Flask Server)
-from flask import Flask, jsonify, request
-import requests
-import time
+from flask import Flask, Response, g, jsonify, request
+from werkzeug.middleware.proxy_fix import ProxyFix
+import json
+import logging
 import threading
+import time
 import os
 from dotenv import load_dotenv
-from telegram import Bot
+import service
+import startup
+from logs import dropped_count, setup_logging
+from metrics import registry
 
 load_dotenv()
+setup_logging()
+logger = logging.getLogger(__name__)
 app = Flask(__name__)
 
 # Load environment variables
-TEMP_MAIL_API_KEY = os.getenv("TEMP_MAIL_API_KEY")
-VIRTUAL_NUMBER_API_KEY = os.getenv("VIRTUAL_NUMBER_API_KEY")
 BOT_TOKEN = os.getenv("BOT_TOKEN")
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org/bot")  # token is appended
+TELEGRAM_POOL_SIZE = int(os.getenv("TELEGRAM_POOL_SIZE", 8))  # connections shared by the outbox and handlers
+# Reverse proxies in front of the app; each appends the caller's address to X-Forwarded-For
+PROXY_HOPS = int(os.getenv("PROXY_HOPS", 1))  # set to 0 when clients connect directly
+# Callers (e.g. a split-off bot) allowed to name the end user in X-Client-Id for per-user limits
+ADMISSION_TRUSTED_CLIENTS = {ip.strip() for ip in os.getenv("ADMISSION_TRUSTED_CLIENTS", "").split(",") if ip.strip()}
 
-# Temp-Mail API setup
-TEMP_MAIL_API_HOST = "temp-mail44.p.rapidapi.com"
-TEMP_MAIL_HEADERS = {
-    "x-rapidapi-key": TEMP_MAIL_API_KEY,
-    "x-rapidapi-host": TEMP_MAIL_API_HOST,
-    "Content-Type": "application/json"
-}
-
-# Virtual Number API setup
-VIRTUAL_NUMBER_API_HOST = "virtual-number.p.rapidapi.com"
-VIRTUAL_NUMBER_HEADERS = {
-    "x-rapidapi-key": VIRTUAL_NUMBER_API_KEY,
-    "x-rapidapi-host": VIRTUAL_NUMBER_API_HOST
-}
-
-# Message Cache
-message_cache = {}
-operation_status = {}
-
-# ------------------- TEMP EMAIL STUFF ------------------- #
-def generate_temp_email():
-    url = f"https://{TEMP_MAIL_API_HOST}/api/v3/email/new"
-    response = requests.post(url, headers=TEMP_MAIL_HEADERS)
-
-    if response.status_code == 200:
-        email_data = response.json()
-        temp_email = email_data.get("email")
-        print(f"✅ Temporary Email Created: {temp_email}")
-        return temp_email
-    else:
-        print("❌ Failed to create email:", response.text)
-        return None
+if PROXY_HOPS:
+    # remote_addr becomes the address our own proxy appended; entries further left are client-supplied
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_HOPS)
 
-def poll_inbox(temp_email):
-    seen_messages = set()
-    
-    try:
-        # Initialize status as "waiting"
-        operation_status[temp_email] = "waiting"
-        
-        for _ in range(15):  # Poll for 15 minutes (90 * 10s = 900s = 15min)
-            # Check if operation has been cancelled
-            if operation_status.get(temp_email) == "cancelled":
-                print(f"📧 Polling cancelled for {temp_email}")
-                return
-            
-            url = f"https://{TEMP_MAIL_API_HOST}/api/v3/email/{temp_email}/messages"
-            response = requests.get(url, headers=TEMP_MAIL_HEADERS)
-
-            if response.status_code == 200:
-                messages = response.json()
-                print(messages)
-                for msg in messages:
-                    msg_id = msg.get("id")
-
-                    if msg_id not in seen_messages:
-                        seen_messages.add(msg_id)
-
-                        message_cache[temp_email] = {
-                            "status": "received",
-                            "from": msg.get("from"),
-                            "subject": msg.get("subject"),
-                            "body": msg.get("body_text") or msg.get("body_html") or "No content" 
-                        }
-
-                        operation_status[temp_email] = "complete"
-                        print("📧 New Message Received!")
-                        return
-            time.sleep(10)
-        
-        # If no messages after 15 minutes
-        message_cache[temp_email] = {
-            "status": "timeout",
-            "message": "No messages received after 15 minutes"
-        }
-        operation_status[temp_email] = "timeout"
-    except Exception as e:
-        print(f"Error while polling inbox: {e}")
-        message_cache[temp_email] = {
-            "status": "error",
-            "message": str(e)
-        }
-        operation_status[temp_email] = "error"
-
-# ------------------- VIRTUAL NUMBER STUFF ------------------- #
-def generate_virtual_phone_number(country_id):
-    url = "https://virtual-number.p.rapidapi.com/api/v1/e-sim/country-numbers"
-    querystring = {"countryId": country_id}
-
-    response = requests.get(url, headers=VIRTUAL_NUMBER_HEADERS, params=querystring)
-    print("📲 Number Fetch Status Code:", response.status_code)
-    print("📲 API Response:", response.text)
-
-    if response.status_code == 200:
-        phone_data = response.json()
-
-        if isinstance(phone_data, list) and phone_data:
-            selected_number = phone_data[0]  # Just get first number
-            return selected_number
-        else:
-            print("❌ No numbers found.")
-            return None
-    else:
-        print("❌ Error fetching number:", response.text)
-        return None
+# Telegram bot client, created once per worker process
+_telegram_bot = None
+_telegram_bot_lock = threading.Lock()
 
-def poll_sms_background(country_id, phone_number, session_id):
-    try:
-        operation_status[session_id] = "waiting"
-        
-        # Poll for up to 5 minutes (30 * 10s = 300s = 5min)
-        for _ in range(30):
-            # Check if operation has been cancelled
-            if operation_status.get(session_id) == "cancelled":
-                print(f"📱 SMS polling cancelled for {phone_number}")
-                return
-            
-            url = "https://virtual-number.p.rapidapi.com/api/v1/e-sim/view-messages"
-            querystring = {"countryId": str(country_id), "number": phone_number}
-            
-            response = requests.get(url, headers=VIRTUAL_NUMBER_HEADERS, params=querystring)
-            
-            if response.status_code == 200:
-                messages = response.json()
-                if messages and isinstance(messages, list) and len(messages) > 0:
-                    message_cache[session_id] = {
-                        "status": "received",
-                        "messages": messages
-                    }
-                    operation_status[session_id] = "complete"
-                    print(f"📱 SMS received for {phone_number}")
-                    return
-            
-            time.sleep(10)
-        
-        # If no SMS after timeout
-        message_cache[session_id] = {
-            "status": "timeout",
-            "message": "No SMS received after 5 minutes"
-        }
-        operation_status[session_id] = "timeout"
-    except Exception as e:
-        print(f"Error while polling SMS: {e}")
-        message_cache[session_id] = {
-            "status": "error",
-            "message": str(e)
-        }
-        operation_status[session_id] = "error"
+def get_telegram_bot():
+    global _telegram_bot
+    if _telegram_bot is None:
+        with _telegram_bot_lock:
+            if _telegram_bot is None:
+                from telegram import Bot
+                from telegram.utils.request import Request
+                _telegram_bot = Bot(token=BOT_TOKEN, base_url=TELEGRAM_API_URL,
+                                    request=Request(con_pool_size=TELEGRAM_POOL_SIZE))
+    return _telegram_bot
+
+# ------------------- REQUEST METRICS ------------------- #
+REQUEST_SECONDS = registry.histogram(
+    "tempgen_http_request_seconds", "Flask request latency by route", ("method", "route", "status"))
+registry.gauge("tempgen_log_records_dropped", "Log records dropped because the log queue was full", dropped_count)
+
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    started = g.get("request_started")
+    if started is not None:
+        # Label by the route pattern, not the concrete URL, to keep the label set small
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        REQUEST_SECONDS.observe(time.perf_counter() - started, request.method, route, response.status_code)
+    return response
+
+# ------------------- ADMISSION ------------------- #
+def client_id():
+    """Who a request is made for, as counted by the per-user session limit."""
+    # The proxy's own X-Forwarded-For entry (see PROXY_HOPS), never one the client wrote
+    address = request.remote_addr
+    if address in ADMISSION_TRUSTED_CLIENTS and request.headers.get("X-Client-Id"):
+        return request.headers["X-Client-Id"]
+    return address
+
+def session_response(payload, status):
+    """JSON response for session-creating routes; rejections tell the client when to retry."""
+    response = jsonify(payload)
+    if status in (429, 503) and "retry_after" in payload:
+        response.headers["Retry-After"] = str(payload["retry_after"])
+    return response, status
+
+# ------------------- CONDITIONAL RESPONSES ------------------- #
+def polled_response(payload, status, since, view):
+    """Session state tagged with its version; 304 without encoding anything when the client is current."""
+    if status != 200:
+        return jsonify(payload), status
+    etag = service.entry_etag(payload, since, view)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(payload)
+    response.set_etag(etag)
+    # Let caches store it, but have them check back every time
+    response.headers["Cache-Control"] = "no-cache"
+    return response
 
 # ------------------- FLASK ROUTES ------------------- #
 @app.route('/generate/email', methods=['GET'])
 def generate_email():
-    temp_email = generate_temp_email()
-    if not temp_email:
-        return jsonify({"error": "Failed to create temporary email"}), 500
-
-    # Initialize the cache entry
-    message_cache[temp_email] = {"status": "pending", "message": "Waiting for emails..."}
-    
-    # Start polling in a separate thread
-    threading.Thread(target=poll_inbox, args=(temp_email,), daemon=True).start()
-    return jsonify({"temp_email": temp_email})
+    payload, status = service.create_email_session(client_id(), service.ADMISSION_WAIT)
+    return session_response(payload, status)
 
 @app.route('/get_messages/<temp_email>', methods=['GET'])
 def get_messages(temp_email):
-    
-    if temp_email in message_cache:
-        return jsonify(message_cache[temp_email])
-    else:
-        return jsonify({"error": "Email not found"}), 404
+    since = request.args.get('since', 0, type=int)
+    view = request.args.get('view', 'full')
+    payload, status = service.get_email_messages(temp_email, request.args.get('wait', 0, type=float), since, view)
+    return polled_response(payload, status, since, view)
 
 @app.route('/generate/number', methods=['GET'])
 def generate_number():
     country_id = request.args.get('country_id', '7')  # Default Russia
-    number = generate_virtual_phone_number(country_id)
-    if number:
-        # Create a unique session ID for this request
-        session_id = f"sms_{country_id}_{number}_{int(time.time())}"
-        
-        # Initialize cache for this session
-        message_cache[session_id] = {"status": "pending", "message": "Waiting for SMS..."}
-        
-        # Start polling in a separate thread
-        threading.Thread(target=poll_sms_background, 
-                         args=(country_id, number, session_id), 
-                         daemon=True).start()
-        
-        return jsonify({
-            "virtual_phone": number,
-            "country_id": country_id,
-            "session_id": session_id
-        })
-    else:
-        return jsonify({"error": "Could not generate virtual phone number"}), 500
+    payload, status = service.create_number_session(country_id, client_id(), service.ADMISSION_WAIT)
+    return session_response(payload, status)
 
 @app.route('/check_sms/<session_id>', methods=['GET'])
 def check_sms(session_id):
-    if session_id in message_cache:
-        return jsonify(message_cache[session_id])
-    else:
+    since = request.args.get('since', 0, type=int)
+    view = request.args.get('view', 'full')
+    payload, status = service.get_sms_status(session_id, request.args.get('wait', 0, type=float), since, view)
+    return polled_response(payload, status, since, view)
+
+@app.route('/generate/email/batch', methods=['POST'])
+def generate_email_batch():
+    body = request.get_json(silent=True) or {}
+    payload, status = service.create_email_batch(body.get('count', 1), client_id(), service.ADMISSION_WAIT)
+    return session_response(payload, status)
+
+@app.route('/generate/number/batch', methods=['POST'])
+def generate_number_batch():
+    # Either an explicit list of country ids, or a count for one country
+    body = request.get_json(silent=True) or {}
+    country_ids = body.get('country_ids')
+    if country_ids is None:
+        count = body.get('count', 1)
+        error = service.batch_size_error(count)
+        if error:
+            return jsonify(error), 400
+        country_ids = [body.get('country_id', '7')] * count
+    payload, status = service.create_number_batch(country_ids, client_id(), service.ADMISSION_WAIT)
+    return session_response(payload, status)
+
+@app.route('/status/batch', methods=['POST'])
+def status_batch():
+    body = request.get_json(silent=True) or {}
+    payload, status = service.get_session_states(body.get('keys'), body.get('since'), body.get('view', 'full'))
+    return jsonify(payload), status
+
+@app.route('/events/<session_key>', methods=['GET'])
+def events(session_key):
+    """Server-Sent Events stream of status changes for an email or SMS session."""
+    if session_key not in service.message_cache:
         return jsonify({"error": "Session not found"}), 404
 
+    # Reconnecting EventSource clients resume from the last cursor they saw
+    since = request.args.get('since', type=int)
+    if since is None:
+        last_event_id = request.headers.get('Last-Event-ID', '')
+        since = int(last_event_id) if last_event_id.isdigit() else 0
+
+    def stream():
+        for entry in service.iter_updates(session_key, since):
+            if entry is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield f"event: status\nid: {entry.get('cursor', 0)}\ndata: {json.dumps(entry)}\n\n"
+
+    return Response(stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @app.route('/cancel/<operation_id>', methods=['POST'])
 def cancel_operation(operation_id):
-    if operation_id in operation_status:
-        operation_status[operation_id] = "cancelled"
-        message_cache[operation_id] = {
-            "status": "cancelled",
-            "message": "Operation was cancelled by user"
-        }
-        return jsonify({"status": "cancelled"})
-    return jsonify({"error": "Operation not found"}), 404
+    payload, status = service.cancel_operation(operation_id)
+    return jsonify(payload), status
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    payload, status = service.get_stats()
+    return jsonify(payload), status
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus text exposition of this worker's metrics."""
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Readiness probe: 503 until the background warm-up has finished."""
+    payload, status = startup.readiness()
+    return jsonify(payload), status
+
+@app.route('/health', methods=['GET'])
+def health():
+    """Provider circuit breaker states; stays 200 so an upstream outage does not restart the service."""
+    payload, status = service.get_health()
+    return jsonify(payload), status
+
+@app.route('/quota', methods=['GET'])
+def quota():
+    payload, status = service.get_quota()
+    return jsonify(payload), status
 
 # Telegram webhook handler
 @app.route('/webhook', methods=['POST'])
 def webhook():
     if request.method == 'POST':
-        update_json = request.get_json(force=True)
-        bot = Bot(token=BOT_TOKEN)
-        # Import process_update function only when needed 
+        # Already imported by the warm-up; an early update waits for that import
         from bot import process_update
-        process_update(update_json, bot)
+        update_json = request.get_json(force=True)
+        if process_update(update_json, get_telegram_bot()) == "overloaded":
+            # Telegram redelivers the update later
+            return {"status": "overloaded"}, 503, {"Retry-After": str(service.ADMISSION_RETRY_AFTER)}
         return {"status": "ok"}
 
 @app.route('/set_webhook', methods=['GET'])
 def set_webhook():
-    webhook_url = os.getenv("WEBHOOK_URL", "https://your-app-url.com/webhook")
-    bot = Bot(token=BOT_TOKEN)
-    result = bot.set_webhook(webhook_url)
-    
-    if result:
-        return jsonify({"status": "success", "message": f"Webhook set to {webhook_url}"})
-    else:
+    webhook_url = startup.webhook_target(os.getenv("WEBHOOK_URL", "https://your-app-url.com/webhook"))
+    try:
+        changed = startup.register_webhook(get_telegram_bot(), webhook_url)
+    except Exception:
+        logger.exception("Failed to set webhook", extra={"url": webhook_url})
         return jsonify({"status": "error", "message": "Failed to set webhook"}), 500
-    
+    message = f"Webhook set to {webhook_url}" if changed else f"Webhook already set to {webhook_url}"
+    return jsonify({"status": "success", "message": message})
+
+# ------------------- WARM-UP ------------------- #
+def load_bot():
+    # python-telegram-bot and APScheduler are most of the import time
+    import bot
+
+def build_dispatcher():
+    import bot
+    # The dispatcher's start needs getMe; wait out a Telegram API that is briefly unreachable
+    startup.wait_for_telegram(get_telegram_bot())
+    bot.get_dispatcher(get_telegram_bot())
+    startup.warm_up.add_check("dispatcher", bot.dispatcher_running)
+
+def resume_checkpoints():
+    # Pick up sessions checkpointed by the previous process before reporting ready
+    import checkpoint
+    checkpoint.init(get_telegram_bot)
+
+# Accept connections right away and load the heavy parts in the background
+startup.warm_up.start([
+    # Fill the address pool while the rest loads, so the first users after a deploy get a hit
+    ("email_pool", service.email_pool.start),
+    ("import_bot", load_bot),
+    ("telegram_client", get_telegram_bot),
+    ("dispatcher", build_dispatcher),
+    ("checkpoint", resume_checkpoints),
+    ("webhook", lambda: startup.register_webhook_async(get_telegram_bot)),
+])
+
 # Only start the Flask app when running app.py directly
 if __name__ == '__main__':
     port = int(os.getenv("PORT", 5000))
@@ -0,0 +1,93 @@
+# bench_dispatcher.py (Webhook dispatch micro-benchmark)
+"""Measure updates/sec through process_update with a rebuilt vs shared dispatcher.
+
+Run from the repository root:
+
+    python bench/bench_dispatcher.py [--updates 2000]
+
+No network access is needed: the Telegram bot is backed by a fake request
+object that answers every API call locally.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram import Bot, Update
+
+import bot as bot_module
+
+FAKE_TOKEN = "123456:ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghi"
+
+
+class FakeRequest:
+    """Stand-in for telegram.utils.request.Request that never touches the network."""
+
+    def post(self, url, data=None, timeout=None):
+        if url.endswith("/getMe"):
+            return {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        return {
+            "message_id": 1,
+            "date": int(time.time()),
+            "chat": {"id": data.get("chat_id", 1) if data else 1, "type": "private"},
+            "text": data.get("text", "") if data else "",
+        }
+
+    def stop(self):
+        pass
+
+
+def make_update(update_id, text="/help"):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": 42, "type": "private"},
+            "from": {"id": 42, "is_bot": False, "first_name": "bench"},
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(text)}],
+        },
+    }
+
+
+def legacy_process_update(update_json, bot):
+    """The pre-change behaviour: build the whole handler graph for every update."""
+    update = Update.de_json(update_json, bot)
+    dispatcher = bot_module.build_dispatcher(bot)
+    dispatcher.process_update(update)
+
+
+def shared_process_update(update_json, bot):
+    """The current behaviour, dispatched inline instead of through the update queue."""
+    dispatcher = bot_module.get_dispatcher(bot)
+    dispatcher.process_update(Update.de_json(update_json, dispatcher.bot))
+
+
+def run(label, fn, bot, updates):
+    payloads = [make_update(i) for i in range(updates)]
+    fn(payloads[0], bot)  # warm-up
+    start = time.perf_counter()
+    for payload in payloads:
+        fn(payload, bot)
+    elapsed = time.perf_counter() - start
+    rate = updates / elapsed
+    print(f"{label:<10} {updates} updates in {elapsed:.3f}s -> {rate:,.0f} updates/sec")
+    return rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--updates", type=int, default=2000)
+    args = parser.parse_args()
+
+    bot = Bot(token=FAKE_TOKEN, request=FakeRequest())
+    before = run("per-update", legacy_process_update, bot, args.updates)
+    after = run("shared", shared_process_update, bot, args.updates)
+    print(f"speed-up: {after / before:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
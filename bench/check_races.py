@@ -0,0 +1,406 @@
+# check_races.py (Deterministic concurrency checks)
+"""Check the race-prone paths of the poll engine, admission, breaker and session store.
+
+Run from the repository root:
+
+    python bench/check_races.py
+
+Each check forces one interleaving with events, or drives time with a fake
+clock, instead of relying on timing; the script exits non-zero if any check
+fails. No network access is needed.
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+import traceback
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import breaker
+from admission import Admission, Rejected
+from breaker import CircuitBreaker, CircuitOpen, PROBE_RETRY_AFTER
+from poller import PollEngine
+from store import SessionStore
+
+TIMEOUT = 5  # seconds any single wait may take before the check is reported as hung
+
+
+def expect(condition, message):
+    if not condition:
+        raise AssertionError(message)
+
+
+def wait_for(event, what):
+    expect(event.wait(TIMEOUT), f"timed out waiting for {what}")
+
+
+class PausingCondition:
+    """Wraps the engine's Condition; ``pause_thread`` stops right after leaving it until ``resume`` is set."""
+
+    def __init__(self, cond):
+        self._cond = cond
+        self.pause_thread = None
+        self.paused = threading.Event()
+        self.resume = threading.Event()
+
+    def __enter__(self):
+        return self._cond.__enter__()
+
+    def __exit__(self, *exc):
+        result = self._cond.__exit__(*exc)
+        if threading.current_thread() is self.pause_thread:
+            self.paused.set()
+            wait_for(self.resume, "resume")
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self._cond, name)
+
+
+# ------------------- Poll engine ------------------- #
+
+def _cancel_during_step(step_result):
+    """Cancel a session while its step runs, then let the step finish with ``step_result``.
+
+    The canceller is held just after it releases the engine lock, so the step
+    thread completes in the window between ``cancel`` dropping the session and
+    calling ``on_done``. Returns how many times ``on_done`` ran.
+    """
+    engine = PollEngine(workers=1)
+    cond = PausingCondition(engine._cond)
+    engine._cond = cond
+
+    in_step = threading.Event()
+    release_step = threading.Event()
+    executed = threading.Event()
+    done = []
+
+    def step(session):
+        in_step.set()
+        wait_for(release_step, "step release")
+        return step_result
+
+    engine.register("k", step, lambda session: None, done.append)
+
+    execute = engine._execute
+
+    def tracked_execute(session):
+        try:
+            execute(session)
+        finally:
+            executed.set()
+
+    engine._execute = tracked_execute
+    try:
+        engine.schedule("key", "k", {}, timeout=60)
+        wait_for(in_step, "step to start")
+
+        canceller = threading.Thread(target=engine.cancel, args=("key",))
+        cond.pause_thread = canceller
+        canceller.start()
+        wait_for(cond.paused, "cancel to drop the session")
+
+        release_step.set()
+        wait_for(executed, "step to finish")
+        cond.resume.set()
+        canceller.join(TIMEOUT)
+        expect(not canceller.is_alive(), "cancel did not return")
+
+        expect(engine.active_count() == 0, "cancelled session is still active")
+        expect(not any(entry[2].key == "key" and not entry[2].cancelled for entry in engine._heap),
+               "cancelled session was rescheduled")
+        return len(done)
+    finally:
+        engine.stop()
+
+
+def check_poller_cancel_while_finishing():
+    calls = _cancel_during_step(None)
+    expect(calls == 1, f"on_done ran {calls} times for a session cancelled as its step finished")
+
+
+def check_poller_cancel_while_rescheduling():
+    calls = _cancel_during_step(0.01)
+    expect(calls == 1, f"on_done ran {calls} times for a session cancelled as its step rescheduled")
+
+
+def check_poller_step_finishes():
+    engine = PollEngine(workers=1)
+    done = threading.Event()
+    calls = []
+    engine.register("k", lambda session: None, lambda session: None,
+                    lambda session: (calls.append(session.key), done.set()))
+    try:
+        engine.schedule("key", "k", {}, timeout=60)
+        wait_for(done, "session to finish")
+        expect(calls == ["key"], f"on_done calls: {calls}")
+        expect(not engine.cancel("key"), "cancel of a finished session reported success")
+        expect(calls == ["key"], "cancel after finishing ran on_done again")
+    finally:
+        engine.stop()
+
+
+# ------------------- Admission ------------------- #
+
+def check_admission_bind_release():
+    admission = Admission(limit=10, per_user=5)
+    admission.acquire("u", count=3)
+    for key in ("a", "b", "c"):
+        admission.bind(key, "u")
+    expect(admission.usage()["in_flight"] == 3, "three bound sessions should hold three slots")
+
+    # A create that finds its session already running hands its slot back
+    admission.acquire("u")
+    admission.bind("a", "u")
+    expect(admission.usage()["in_flight"] == 3, "rebinding an existing session took a second slot")
+
+    for key in ("a", "b", "c"):
+        expect(admission.release(key), f"release({key}) reported an unknown key")
+    expect(not admission.release("a"), "second release of the same key was not ignored")
+    usage = admission.usage()
+    expect(usage["in_flight"] == 0 and usage["users"] == 0, f"slots leaked: {usage}")
+
+
+def check_admission_cancel():
+    admission = Admission(limit=10, per_user=5)
+    admission.acquire("u", count=4)
+    admission.bind("a", "u")
+    admission.cancel("u", count=3)  # three creations failed
+    expect(admission.usage()["in_flight"] == 1, "cancel did not return the unused slots")
+    admission.release("a")
+    usage = admission.usage()
+    expect(usage["in_flight"] == 0 and usage["users"] == 0, f"slots leaked: {usage}")
+
+
+def check_admission_limits():
+    admission = Admission(limit=4, per_user=2)
+    admission.acquire("u", count=2)
+    try:
+        admission.acquire("u")
+        raise AssertionError("third slot for a user at per_user was admitted")
+    except Rejected as e:
+        expect(e.reason == "user_limit", f"expected user_limit, got {e.reason}")
+
+    # A batch brings its own per-user allowance
+    admission.acquire("batch", count=2, per_user=100)
+    try:
+        admission.acquire("v")
+        raise AssertionError("slot beyond the global limit was admitted")
+    except Rejected as e:
+        expect(e.reason == "busy", f"expected busy, got {e.reason}")
+
+    # Resumed sessions are restored even past the limits
+    admission.occupy("resumed", "u")
+    expect(admission.usage()["in_flight"] == 5, "occupy did not take a slot")
+    admission.occupy("resumed", "u")
+    expect(admission.usage()["in_flight"] == 5, "occupy of a held key took a second slot")
+
+
+def check_admission_queue():
+    admission = Admission(limit=1, per_user=5, queue_size=1)
+    admission.acquire("u")
+    admission.bind("a", "u")
+
+    outcome = {}
+    waiter_done = threading.Event()
+
+    def waiter():
+        try:
+            admission.acquire("v", wait=TIMEOUT)
+            outcome["admitted"] = True
+        except Rejected as e:
+            outcome["rejected"] = e.reason
+        waiter_done.set()
+
+    thread = threading.Thread(target=waiter)
+    thread.start()
+    deadline = time.monotonic() + TIMEOUT
+    while admission.usage()["waiting"] != 1:
+        expect(time.monotonic() < deadline, "waiter never queued")
+        time.sleep(0.001)
+
+    try:
+        admission.acquire("w", wait=1)
+        raise AssertionError("caller beyond queue_size was queued")
+    except Rejected as e:
+        expect(e.reason == "busy", f"expected busy, got {e.reason}")
+
+    admission.release("a")
+    wait_for(waiter_done, "queued caller")
+    expect(outcome == {"admitted": True}, f"queued caller: {outcome}")
+    usage = admission.usage()
+    expect(usage["in_flight"] == 1 and usage["waiting"] == 0, f"after hand-over: {usage}")
+
+
+# ------------------- Circuit breaker ------------------- #
+
+class FakeClock:
+    """Stands in for the breaker module's ``time`` while installed with ``with``."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def __enter__(self):
+        self._real, breaker.time = breaker.time, self
+        return self
+
+    def __exit__(self, *exc):
+        breaker.time = self._real
+
+
+def _open_breaker(clock):
+    circuit = CircuitBreaker("check", window=4, min_calls=4, failure_rate=0.5, slow_call=5, open_for=30)
+    for ok in (True, True, False, False):
+        expect(circuit.before() is False, "call in a closed circuit was marked as a probe")
+        circuit.record(ok, 0.1)
+    expect(circuit.state == breaker.OPEN, f"circuit should open at the threshold, is {circuit.state}")
+    return circuit
+
+
+def check_breaker_open_and_probe():
+    with FakeClock() as clock:
+        circuit = _open_breaker(clock)
+
+        try:
+            circuit.before()
+            raise AssertionError("open circuit admitted a call")
+        except CircuitOpen as e:
+            expect(e.retry_after == 30, f"retry_after while open: {e.retry_after}")
+
+        # A call that started before the circuit opened must not close it
+        circuit.record(True, 0.1)
+        expect(circuit.state == breaker.OPEN, "late success reopened the circuit")
+
+        clock.now += 30
+        expect(circuit.before() is True, "first call after open_for was not the probe")
+        try:
+            circuit.before()
+            raise AssertionError("second call admitted while the probe is in flight")
+        except CircuitOpen as e:
+            expect(e.retry_after == PROBE_RETRY_AFTER, f"retry_after during probe: {e.retry_after}")
+
+        circuit.record(False, 0.1, probe=True)
+        expect(circuit.state == breaker.OPEN, "failed probe did not reopen the circuit")
+        expect(circuit.retry_after() == 30, "reopened circuit did not restart open_for")
+
+        clock.now += 30
+        expect(circuit.before() is True, "no probe after the circuit reopened")
+        circuit.record(True, 0.1, probe=True)
+        expect(circuit.state == breaker.CLOSED, "successful probe did not close the circuit")
+        expect(circuit.before() is False, "closed circuit still probing")
+
+
+def check_breaker_slow_probe():
+    with FakeClock() as clock:
+        circuit = _open_breaker(clock)
+        clock.now += 30
+        expect(circuit.before() is True, "first call after open_for was not the probe")
+        circuit.record(True, 6, probe=True)  # answered, but slower than slow_call
+        expect(circuit.state == breaker.OPEN, "slow probe closed the circuit")
+
+
+def check_breaker_concurrent_probe():
+    with FakeClock() as clock:
+        circuit = _open_breaker(clock)
+        clock.now += 30
+
+        start = threading.Barrier(8)
+        probes = []
+        refused = []
+
+        def call():
+            start.wait(TIMEOUT)
+            try:
+                probes.append(circuit.before())
+            except CircuitOpen as e:
+                refused.append(e.retry_after)
+
+        threads = [threading.Thread(target=call) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(TIMEOUT)
+        expect(probes == [True], f"half-open circuit admitted {probes}")
+        expect(refused == [PROBE_RETRY_AFTER] * 7, f"refused callers were told {refused}")
+
+
+# ------------------- Session store ------------------- #
+
+def check_store_add():
+    store = SessionStore(max_entries=2)
+    expect(store.add("a", 1), "add to an empty key failed")
+    expect(not store.add("a", 2), "add overwrote a live key")
+    expect(store.get("a") == 1, "add changed the stored value")
+
+    store.set("b", 1, ttl=0)
+    expect(store.add("b", 2), "add refused an expired key")
+    expect(store.get("b") == 2, "add did not replace the expired value")
+
+    store.get("a")  # "a" is now the most recently used
+    store.add("c", 3)
+    expect("b" not in store and "a" in store and "c" in store, "LRU eviction dropped the wrong key")
+    expect(store.stats()["bytes"] == sum(entry[2] for entry in store._data.values()),
+           "byte accounting drifted")
+
+
+def check_store_concurrent_add():
+    store = SessionStore()
+    start = threading.Barrier(8)
+    winners = []
+
+    def claim(n):
+        start.wait(TIMEOUT)
+        if store.add("key", n):
+            winners.append(n)
+
+    threads = [threading.Thread(target=claim, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(TIMEOUT)
+    expect(len(winners) == 1, f"{len(winners)} concurrent adds won")
+    expect(store.get("key") == winners[0], "stored value is not the winner's")
+
+
+CHECKS = [
+    check_poller_cancel_while_finishing,
+    check_poller_cancel_while_rescheduling,
+    check_poller_step_finishes,
+    check_admission_bind_release,
+    check_admission_cancel,
+    check_admission_limits,
+    check_admission_queue,
+    check_breaker_open_and_probe,
+    check_breaker_slow_probe,
+    check_breaker_concurrent_probe,
+    check_store_add,
+    check_store_concurrent_add,
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-k", dest="pattern", default="", help="only run checks whose name contains this")
+    args = parser.parse_args()
+
+    failed = 0
+    for check in CHECKS:
+        if args.pattern not in check.__name__:
+            continue
+        try:
+            check()
+            print(f"ok    {check.__name__}")
+        except Exception:
+            failed += 1
+            print(f"FAIL  {check.__name__}")
+            traceback.print_exc()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
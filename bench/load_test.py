@@ -0,0 +1,390 @@
+# load_test.py (End-to-end load test)
+"""Drive the app through /webhook and the REST routes with N concurrent simulated users.
+
+Run from the repository root:
+
+    python bench/load_test.py [--users 20] [--duration 30] [--server flask|gunicorn]
+    python bench/load_test.py --save-baseline bench/baseline.json
+    python bench/load_test.py --compare bench/baseline.json
+
+Everything runs offline on one Linux box: the temp-mail, virtual-number
+and Telegram Bot APIs are local stubs (see stubs.py) with optional
+latency, error and 429 injection, and the app runs as a subprocess
+pointed at them. Reports webhook p50/p99, sessions per second, the app's
+peak thread count and RSS, and upstream calls per delivered message.
+--compare exits non-zero when a key metric regresses past --tolerance.
+"""
+import argparse
+import itertools
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stubs import Faults, TelegramStub, TempMailStub, VirtualNumberStub
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKE_TOKEN = "123456:ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghi"
+EMAIL_MARKER = "New Message Received"
+SMS_MARKER = "New SMS Received"
+
+# Metric -> True when a higher value is better, used by --compare
+KEY_METRICS = {
+    "webhook_p50_ms": False,
+    "webhook_p99_ms": False,
+    "sessions_per_sec": True,
+    "peak_threads": False,
+    "peak_rss_mb": False,
+    "upstream_calls_per_message": False,
+}
+
+
+class Results:
+    """Thread-safe tallies collected by the simulated users."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.webhook_latencies = []
+        self.rest_latencies = []
+        self.sessions = 0
+        self.failed_sessions = 0
+        self.rest_messages = 0
+        self.errors = 0
+
+    def add(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def latency(self, kind, seconds):
+        with self._lock:
+            (self.webhook_latencies if kind == "webhook" else self.rest_latencies).append(seconds)
+
+
+class ProcessSampler(threading.Thread):
+    """Samples thread count and RSS of a process and its children from /proc."""
+
+    def __init__(self, pid, interval=0.25):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak_threads = 0
+        self.peak_rss_kb = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            threads = rss = 0
+            for pid in _process_tree(self.pid):
+                status = _proc_status(pid)
+                threads += status.get("Threads", 0)
+                rss += status.get("VmRSS", 0)
+            self.peak_threads = max(self.peak_threads, threads)
+            self.peak_rss_kb = max(self.peak_rss_kb, rss)
+
+    def stop(self):
+        self._stop_event.set()
+
+
+def _proc_status(pid):
+    values = {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("Threads", "VmRSS"):
+                    values[key] = int(value.split()[0])
+    except OSError:
+        pass
+    return values
+
+
+def _process_tree(root):
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    tree, stack = [], [root]
+    while stack:
+        pid = stack.pop()
+        tree.append(pid)
+        stack.extend(children.get(pid, ()))
+    return tree
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_app(args, stubs):
+    port = free_port()
+    env = dict(
+        os.environ,
+        PORT=str(port),
+        BOT_TOKEN=FAKE_TOKEN,
+        TELEGRAM_API_URL=stubs["telegram"].url + "/bot",
+        TEMP_MAIL_BASE_URL=stubs["temp_mail"].url,
+        VIRTUAL_NUMBER_BASE_URL=stubs["virtual_number"].url,
+        TEMP_MAIL_API_KEY="bench",
+        VIRTUAL_NUMBER_API_KEY="bench",
+        BOT_POLL_INTERVAL=str(args.bot_poll_interval),
+        STATE_BACKEND="memory",
+        CHECKPOINT_DIR="",  # every run starts cold
+        WEBHOOK_URL="",
+        ADMISSION_PER_USER="0",  # every simulated REST user shares 127.0.0.1
+        LOG_LEVEL="WARNING",
+    )
+    env.pop("API_BASE_URL", None)
+    if args.server == "gunicorn":
+        cmd = ["gunicorn", "--worker-class", "gevent", "--worker-connections", "1000",
+               "--workers", "1", "--bind", f"127.0.0.1:{port}", "main:flask_app"]
+    else:
+        cmd = [sys.executable, "app.py"]
+    process = subprocess.Popen(cmd, cwd=REPO_ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=None if args.verbose else subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"app exited with code {process.returncode}")
+        try:
+            if requests.get(base_url + "/ready", timeout=1).status_code == 200:
+                return process, base_url
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    process.kill()
+    raise SystemExit("app did not start within 30s")
+
+
+class SimulatedUser(threading.Thread):
+    """Alternates email and SMS sessions over REST or the bot webhook until the run ends."""
+
+    update_ids = itertools.count(1)
+
+    def __init__(self, index, base_url, telegram, results, stop_at, args):
+        super().__init__(daemon=True)
+        self.chat_id = 10_000 + index
+        self.use_webhook = index < round(args.users * args.webhook_share)
+        self.base_url = base_url
+        self.telegram = telegram
+        self.results = results
+        self.stop_at = stop_at
+        self.timeout = args.session_timeout
+        self.http = requests.Session()
+
+    def run(self):
+        for kind in itertools.cycle(("email", "sms")):
+            if time.time() >= self.stop_at:
+                return
+            try:
+                if self.use_webhook:
+                    delivered = self.webhook_session(kind)
+                else:
+                    delivered = self.rest_session(kind)
+            except requests.RequestException:
+                self.results.add(errors=1)
+                delivered = False
+            if delivered:
+                self.results.add(sessions=1)
+            else:
+                self.results.add(failed_sessions=1)
+
+    def timed(self, kind, method, path, **kwargs):
+        started = time.perf_counter()
+        response = self.http.request(method, self.base_url + path, timeout=self.timeout + 15, **kwargs)
+        self.results.latency(kind, time.perf_counter() - started)
+        return response
+
+    # REST clients long-poll until the first message arrives, then cancel
+    def rest_session(self, kind):
+        if kind == "email":
+            created = self.timed("rest", "GET", "/generate/email")
+            key = created.json().get("temp_email") if created.ok else None
+            path = "/get_messages/{}"
+        else:
+            created = self.timed("rest", "GET", "/generate/number", params={"country_id": "7"})
+            key = created.json().get("session_id") if created.ok else None
+            path = "/check_sms/{}"
+        if not key:
+            self.results.add(errors=1)
+            return False
+        try:
+            deadline = time.time() + self.timeout
+            while time.time() < deadline:
+                entry = self.http.get(self.base_url + path.format(key),
+                                      params={"wait": min(10, self.timeout)}, timeout=self.timeout + 15).json()
+                if entry.get("messages"):
+                    self.results.add(rest_messages=len(entry["messages"]))
+                    return True
+                if entry.get("done"):
+                    return False
+            return False
+        finally:
+            self.http.post(self.base_url + f"/cancel/{key}", timeout=10)
+
+    # Bot users send commands through /webhook and wait for the relayed message
+    def webhook_session(self, kind):
+        start = self.telegram.sent_count(self.chat_id)
+        if kind == "email":
+            self.send("/generate_email")
+            marker = EMAIL_MARKER
+        else:
+            self.send("/generate_phone")
+            self.send("7")
+            marker = SMS_MARKER
+        delivered = self.telegram.wait_for(self.chat_id, marker, start, self.timeout) is not None
+        self.send("/cancel")
+        return delivered
+
+    def send(self, text):
+        update_id = next(self.update_ids)
+        message = {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": self.chat_id, "type": "private"},
+            "from": {"id": self.chat_id, "is_bot": False, "first_name": "bench"},
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text)}]
+        response = self.timed("webhook", "POST", "/webhook", json={"update_id": update_id, "message": message})
+        response.raise_for_status()
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * pct / 100), len(ordered) - 1)]
+
+
+def run(args):
+    provider_faults = Faults(args.latency, args.jitter, args.error_rate, args.throttle_rate)
+    stubs = {
+        "temp_mail": TempMailStub(provider_faults, deliver_after=args.deliver_after).start(),
+        "virtual_number": VirtualNumberStub(provider_faults, sms_every=args.deliver_after).start(),
+        "telegram": TelegramStub(Faults(args.telegram_latency)).start(),
+    }
+    process, base_url = start_app(args, stubs)
+    sampler = ProcessSampler(process.pid)
+    sampler.start()
+    results = Results()
+    try:
+        started = time.time()
+        stop_at = started + args.duration
+        users = [SimulatedUser(i, base_url, stubs["telegram"], results, stop_at, args) for i in range(args.users)]
+        for user in users:
+            user.start()
+        for user in users:
+            user.join()
+        elapsed = time.time() - started
+    finally:
+        sampler.stop()
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+    upstream_calls = stubs["temp_mail"].total_calls() + stubs["virtual_number"].total_calls()
+    bot_messages = (stubs["telegram"].count_containing(EMAIL_MARKER)
+                    + stubs["telegram"].count_containing(SMS_MARKER))
+    delivered = results.rest_messages + bot_messages
+    for stub in stubs.values():
+        stub.stop()
+
+    return {
+        "config": {key: value for key, value in vars(args).items()
+                   if key not in ("save_baseline", "compare", "tolerance", "verbose")},
+        "elapsed_sec": round(elapsed, 2),
+        "sessions": results.sessions,
+        "failed_sessions": results.failed_sessions,
+        "errors": results.errors,
+        "sessions_per_sec": round(results.sessions / elapsed, 3),
+        "webhook_requests": len(results.webhook_latencies),
+        "webhook_p50_ms": round(percentile(results.webhook_latencies, 50) * 1000, 2),
+        "webhook_p99_ms": round(percentile(results.webhook_latencies, 99) * 1000, 2),
+        "rest_p50_ms": round(percentile(results.rest_latencies, 50) * 1000, 2),
+        "rest_p99_ms": round(percentile(results.rest_latencies, 99) * 1000, 2),
+        "peak_threads": sampler.peak_threads,
+        "peak_rss_mb": round(sampler.peak_rss_kb / 1024, 1),
+        "upstream_calls": upstream_calls,
+        "upstream_by_route": {name: dict(stub.calls) for name, stub in stubs.items()},
+        "injected_faults": {name: dict(stub.injected) for name, stub in stubs.items() if stub.injected},
+        "delivered_messages": delivered,
+        "upstream_calls_per_message": round(upstream_calls / delivered, 2) if delivered else None,
+    }
+
+
+def compare(report, baseline, tolerance):
+    """Print each key metric against the baseline; return the names that regressed."""
+    regressions = []
+    for name, higher_is_better in KEY_METRICS.items():
+        old, new = baseline.get(name), report.get(name)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        worse = -change if higher_is_better else change
+        flag = "REGRESSION" if worse > tolerance else ""
+        print(f"{name:<28} {old:>10} -> {new:>10} ({change:+.1%}) {flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=30, help="seconds to keep starting sessions")
+    parser.add_argument("--webhook-share", type=float, default=0.5, help="fraction of users that use the bot")
+    parser.add_argument("--server", choices=("flask", "gunicorn"), default="flask")
+    parser.add_argument("--latency", type=float, default=0.05, help="provider stub latency (s)")
+    parser.add_argument("--jitter", type=float, default=0.05, help="extra random provider latency (s)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of provider calls answered 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of provider calls answered 429")
+    parser.add_argument("--telegram-latency", type=float, default=0.02)
+    parser.add_argument("--deliver-after", type=float, default=2.0, help="seconds until a message arrives")
+    parser.add_argument("--bot-poll-interval", type=float, default=1.0)
+    parser.add_argument("--session-timeout", type=float, default=30)
+    parser.add_argument("--save-baseline", metavar="PATH")
+    parser.add_argument("--compare", metavar="PATH")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    parser.add_argument("--verbose", action="store_true", help="show the app's log output")
+    args = parser.parse_args()
+
+    report = run(args)
+    print(json.dumps(report, indent=2))
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+        print(f"baseline saved to {args.save_baseline}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get("config") != report["config"]:
+            print("warning: baseline was recorded with a different configuration")
+        if compare(report, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+# stubs.py (Local provider and Telegram API stubs)
+"""Offline HTTP stand-ins for temp-mail44, virtual-number and the Telegram Bot API.
+
+Each stub runs a threaded HTTP/1.1 server on 127.0.0.1 and can inject
+latency, 5xx errors and 429 responses. Every request is counted per
+route so a load test can report upstream calls per delivered message.
+"""
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class Faults:
+    """Latency, error and throttle injection shared by every route of a stub."""
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, throttle_rate=0.0, retry_after=1):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+
+    def delay(self):
+        wait = self.latency + random.uniform(0, self.jitter)
+        if wait > 0:
+            time.sleep(wait)
+
+    def pick(self):
+        """Return an injected status code (500 or 429), or None to answer normally."""
+        roll = random.random()
+        if roll < self.error_rate:
+            return 500
+        if roll < self.error_rate + self.throttle_rate:
+            return 429
+        return None
+
+
+class StubServer:
+    """Base class: subclasses implement ``handle(method, path, query, body)`` -> (status, payload)."""
+
+    route_name = "stub"
+
+    def __init__(self, faults=None):
+        self.faults = faults or Faults()
+        self.calls = Counter()
+        self.injected = Counter()
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _serve(self, method):
+                url = urlparse(self.path)
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                stub.faults.delay()
+                route = stub.route(url.path)
+                with stub._lock:
+                    stub.calls[route] += 1
+                injected = stub.faults.pick()
+                if injected is not None:
+                    with stub._lock:
+                        stub.injected[injected] += 1
+                    status, payload = injected, {"error": "injected"}
+                else:
+                    status, payload = stub.handle(method, url.path, parse_qs(url.query), _decode(raw, self.headers))
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                if status == 429:
+                    self.send_header("Retry-After", str(stub.faults.retry_after))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                self._serve("GET")
+
+            def do_POST(self):
+                self._serve("POST")
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name=self.route_name, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def route(self, path):
+        return path
+
+    def total_calls(self):
+        with self._lock:
+            return sum(self.calls.values())
+
+    def handle(self, method, path, query, body):
+        raise NotImplementedError
+
+
+class TempMailStub(StubServer):
+    """temp-mail44: each new inbox receives one message ``deliver_after`` seconds after creation."""
+
+    route_name = "temp-mail-stub"
+
+    def __init__(self, faults=None, deliver_after=1.0):
+        super().__init__(faults)
+        self.deliver_after = deliver_after
+        self._created = {}
+        self._ids = iter(range(1, 1 << 62))
+
+    def route(self, path):
+        return "email/new" if path.endswith("/email/new") else "email/messages"
+
+    def handle(self, method, path, query, body):
+        if path == "/api/v3/email/new" and method == "POST":
+            with self._lock:
+                address = f"user{next(self._ids)}@bench.test"
+                self._created[address] = time.time()
+            return 200, {"email": address, "token": "bench"}
+
+        match = re.fullmatch(r"/api/v3/email/([^/]+)/messages", path)
+        if match and method == "GET":
+            created = self._created.get(match.group(1))
+            if created is None:
+                return 404, {"error": "unknown inbox"}
+            if time.time() - created < self.deliver_after:
+                return 200, []
+            return 200, [{
+                "id": f"{match.group(1)}-1",
+                "from": "noreply@bench.test",
+                "subject": "Your code",
+                "body_text": "Your verification code is 123456",
+            }]
+        return 404, {"error": "not found"}
+
+
+class VirtualNumberStub(StubServer):
+    """virtual-number: ``numbers`` shared numbers per country, each receiving an SMS every ``sms_every`` seconds."""
+
+    route_name = "virtual-number-stub"
+
+    def __init__(self, faults=None, numbers=50, sms_every=2.0, keep=3):
+        super().__init__(faults)
+        self.numbers = numbers
+        self.sms_every = sms_every
+        self.keep = keep
+        self.started = time.time()
+
+    def route(self, path):
+        return path.rsplit("/", 1)[-1]
+
+    def handle(self, method, path, query, body):
+        country = query.get("countryId", ["7"])[0]
+        if path == "/api/v1/e-sim/country-numbers":
+            return 200, [f"+{country}{900000 + i}" for i in range(self.numbers)]
+        if path == "/api/v1/e-sim/view-messages":
+            number = query.get("number", [""])[0]
+            tick = int((time.time() - self.started) / self.sms_every)
+            return 200, [
+                {"id": f"{number}-{n}", "from": "BenchSvc", "message": f"Code {n:06d}", "time": str(n)}
+                for n in range(max(tick - self.keep, 0), tick)
+            ]
+        return 404, {"error": "not found"}
+
+
+class TelegramStub(StubServer):
+    """Telegram Bot API: answers every method and records what was sent to each chat."""
+
+    route_name = "telegram-stub"
+
+    def __init__(self, faults=None):
+        super().__init__(faults)
+        self._sent = defaultdict(list)   # chat_id -> texts
+        self._changed = threading.Condition(self._lock)
+        self._message_ids = iter(range(1, 1 << 62))
+        self.webhook_url = ""
+
+    def route(self, path):
+        return path.rsplit("/", 1)[-1]
+
+    def handle(self, method, path, query, body):
+        api_method = path.rsplit("/", 1)[-1]
+        if api_method == "getMe":
+            return 200, {"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "bench",
+                                                "username": "bench_bot"}}
+        if api_method == "getWebhookInfo":
+            return 200, {"ok": True, "result": {"url": self.webhook_url, "has_custom_certificate": False,
+                                                "pending_update_count": 0}}
+        if api_method == "setWebhook":
+            self.webhook_url = body.get("url", "")
+            return 200, {"ok": True, "result": True}
+        if api_method in ("sendMessage", "editMessageText"):
+            chat_id = int(body.get("chat_id", 0))
+            text = body.get("text", "")
+            with self._changed:
+                self._sent[chat_id].append(text)
+                message_id = next(self._message_ids)
+                self._changed.notify_all()
+            return 200, {"ok": True, "result": {
+                "message_id": message_id, "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"}, "text": text,
+            }}
+        return 200, {"ok": True, "result": True}
+
+    def wait_for(self, chat_id, marker, start, timeout):
+        """Wait until a text containing ``marker`` was sent to the chat at index >= start. Returns the index or None."""
+        deadline = time.time() + timeout
+        with self._changed:
+            while True:
+                texts = self._sent[chat_id]
+                for i in range(start, len(texts)):
+                    if marker in texts[i]:
+                        return i
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                self._changed.wait(remaining)
+
+    def sent_count(self, chat_id):
+        with self._lock:
+            return len(self._sent[chat_id])
+
+    def count_containing(self, marker):
+        with self._lock:
+            return sum(marker in text for texts in self._sent.values() for text in texts)
+
+
+def _decode(raw, headers):
+    if not raw:
+        return {}
+    if "json" in (headers.get("Content-Type") or ""):
+        try:
+            return json.loads(raw)
+        except ValueError:
+            return {}
+    return {k: v[0] for k, v in parse_qs(raw.decode()).items()}
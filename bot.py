@@ -1,32 +1,79 @@
 # bot.py (Telegram Bot)
+import logging
 import os
-import requests
+import random
+import threading
 import time
+from collections import deque
+from queue import Queue
 from dotenv import load_dotenv
+from api_client import get_api
+from metrics import registry
+from outbox import Outbox
+from state import get_backend
 from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove 
 from telegram.ext import (
     CommandHandler, MessageHandler, Filters, CallbackContext,
-    ConversationHandler, Dispatcher
+    ConversationHandler, Dispatcher, JobQueue
 )
 
 # Load environment variables
 load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
+logger = logging.getLogger(__name__)
 
-# Define API base URL - use an environment variable to allow different deployment locations
-API_BASE_URL = os.getenv("API_BASE_URL", "http://localhost:5000")
+# In-process service calls by default; set API_BASE_URL to reach a remote API instead
+api = get_api()
 
 # Define states for conversation
 WAITING_FOR_COUNTRY = 1
 
-# Dictionary to store active sessions
-active_sessions = {}
+# Background wait settings
+POLL_INTERVAL = float(os.getenv("BOT_POLL_INTERVAL", 10))  # seconds between status checks
+EMAIL_WAIT_SECONDS = 900   # 15 minutes
+SMS_WAIT_SECONDS = 300     # 5 minutes
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", 4))
+
+# Outbound Telegram limits (messages/second globally and per chat)
+TELEGRAM_RATE = float(os.getenv("TELEGRAM_RATE", 30))
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", 1))
+TELEGRAM_CHAT_BURST = int(os.getenv("TELEGRAM_CHAT_BURST", 3))
+BOT_SEND_WORKERS = int(os.getenv("BOT_SEND_WORKERS", 4))
+BOT_DEDUPE_SIZE = int(os.getenv("BOT_DEDUPE_SIZE", 10000))  # recent update ids remembered per worker
+BOT_DEDUPE_TTL = int(os.getenv("BOT_DEDUPE_TTL", 3600))      # seconds update ids are shared between workers
+BOT_MAX_QUEUED_UPDATES = int(os.getenv("BOT_MAX_QUEUED_UPDATES", 1000))  # refuse webhooks beyond this backlog
+
+# Active sessions per user (shared between workers when STATE_BACKEND=sqlite)
+active_sessions = get_backend().mapping("active_sessions")
+
+# ───────────────────────────────────────────── #
+# Outbound messages (queued, never sent from the handler thread)
+# ───────────────────────────────────────────── #
+def send(context, chat_id, text, **kwargs):
+    """Queue a message on the outbox. Returns a handle that ``edit`` can target."""
+    return context.bot_data["outbox"].send(chat_id, text, **kwargs)
+
+def reply(update, context, text, **kwargs):
+    return send(context, update.effective_chat.id, text, **kwargs)
+
+def edit(context, message, text, **kwargs):
+    context.bot_data["outbox"].edit(message, text, **kwargs)
+
+def busy_text(status, payload):
+    """What to tell a user whose session request was turned away by admission control or a down provider."""
+    retry_after = payload.get("retry_after", 5)
+    if payload.get("provider"):
+        return f"⚠️ Our provider is unavailable right now. Please try again in {retry_after} seconds."
+    if status == 429:
+        return ("⏳ You already have the maximum number of active sessions.\n"
+                f"Use /cancel to stop one, or try again in {retry_after} seconds.")
+    return f"⏳ The service is busy right now. Please try again in {retry_after} seconds."
 
 # ───────────────────────────────────────────── #
 # Start & Help
 # ───────────────────────────────────────────── #
 def start(update: Update, context: CallbackContext):
-    update.message.reply_text(
+    reply(update, context,
         "👋 Welcome to *TempGen Bot*!\n\n"
         "Use the commands below:\n"
         "• /generate_email - Get a temp email\n"
@@ -43,91 +90,116 @@ def help_command(update: Update, context: CallbackContext):
 # Generate Email
 # ───────────────────────────────────────────── #
 def generate_email(update: Update, context: CallbackContext):
+    user_id = update.effective_user.id
     try:
         # Cancel any existing operation
-        user_id = update.effective_user.id
         if user_id in active_sessions:
             session_id = active_sessions[user_id].get('email')
             if session_id:
-                requests.post(f"{API_BASE_URL}/cancel/{session_id}")
+                api.cancel(session_id)
         
         # Inform user
-        status_message = update.message.reply_text("🔍 Generating temporary email...")
+        status_message = reply(update, context, "🔍 Generating temporary email...")
         
         # Request new email
-        response = requests.get(f"{API_BASE_URL}/generate/email")
-        if response.status_code != 200:
-            update.message.reply_text("❌ Could not generate email.")
+        payload, status = api.generate_email(user=f"tg:{user_id}")
+        if status in (429, 503):
+            edit(context, status_message, busy_text(status, payload))
+            return
+        if status != 200:
+            reply(update, context, "❌ Could not generate email.")
             return
 
-        temp_email = response.json().get("temp_email")
+        temp_email = payload.get("temp_email")
         if not temp_email:
-            update.message.reply_text("❌ Email generation failed.")
+            reply(update, context, "❌ Email generation failed.")
             return
             
         # Store the email in active sessions
         active_sessions[user_id] = {'email': temp_email, 'type': 'email'}
         
         # Update status message
-        status_message.edit_text(
+        edit(context, status_message,
             f"📧 Temporary Email created: `{temp_email}`\n\n"
             "Waiting for incoming messages (15 mins max)...\n"
             "Use /cancel to stop waiting.",
             parse_mode='Markdown'
         )
 
-        # Poll for messages
-        for attempt in range(90):  # 15 minutes (90 * 10s)
-            message_response = requests.get(f"{API_BASE_URL}/get_messages/{temp_email}")
-            
-            if message_response.status_code == 200:
-                msg_data = message_response.json()
-                print(msg_data)
-                
-                if msg_data.get("status") == "received":
-                    update.message.reply_text(
-                        f"💌 New Message Received!\n\n"
-                        f"From: {msg_data['from']}\n"
-                        f"Subject: {msg_data['subject']}\n\n"
-                        f"{msg_data['body']}"
-                    )
-                    # Clear session
-                    if user_id in active_sessions:
-                        del active_sessions[user_id]
-                    return
-                elif msg_data.get("status") == "timeout":
-                    update.message.reply_text("📭 No new messages arrived in 15 minutes. Try again later.")
-                    # Clear session
-                    if user_id in active_sessions:
-                        del active_sessions[user_id]
-                    return
+        # Wait for messages in the background so the webhook is not held up
+        context.job_queue.run_repeating(
+            check_email_job,
+            interval=POLL_INTERVAL,
+            first=POLL_INTERVAL,
+            context={
+                'chat_id': update.effective_chat.id,
+                'user_id': user_id,
+                'temp_email': temp_email,
+                'cursor': 0,
+                'deadline': time.time() + EMAIL_WAIT_SECONDS,
+            },
+            name=f"email:{user_id}"
+        )
+
+    except Exception as e:
+        reply(update, context, f"⚠️ Error: {e}")
+        # Clear session
+        if user_id in active_sessions:
+            del active_sessions[user_id]
+
+def check_email_job(context: CallbackContext):
+    """Background job: forward new inbox messages to the chat until the session ends."""
+    job = context.job
+    data = job.context
+    user_id, temp_email, chat_id = data['user_id'], data['temp_email'], data['chat_id']
+
+    # Check if user has cancelled or started a new operation
+    if user_id not in active_sessions or active_sessions[user_id].get('email') != temp_email:
+        job.schedule_removal()
+        return
+
+    try:
+        # Only fetch messages we have not forwarded yet
+        msg_data, status = api.get_messages(temp_email, since=data['cursor'])
+
+        if status == 200:
+            for msg in msg_data.get("messages", []):
+                send(context,
+                    chat_id,
+                    f"💌 New Message Received!\n\n"
+                    f"From: {msg.get('from')}\n"
+                    f"Subject: {msg.get('subject')}\n\n"
+                    f"{msg.get('body')}"
+                )
+            data['cursor'] = msg_data.get("cursor", data['cursor'])
+
+            if msg_data.get("done"):
+                if msg_data.get("status") == "timeout":
+                    send(context, chat_id, "📭 No new messages arrived in 15 minutes. Try again later.")
                 elif msg_data.get("status") == "error":
-                    update.message.reply_text(f"⚠️ Error: {msg_data.get('message', 'Unknown error')}")
-                    # Clear session
-                    if user_id in active_sessions:
-                        del active_sessions[user_id]
-                    return
+                    send(context, chat_id, f"⚠️ Error: {msg_data.get('message', 'Unknown error')}")
                 elif msg_data.get("status") == "cancelled":
                     # Already handled by cancel function
+                    job.schedule_removal()
                     return
-            
-            # Check if user has cancelled
-            if user_id not in active_sessions or active_sessions[user_id].get('email') != temp_email:
+                _end_session(job, user_id)
                 return
-                
-            time.sleep(10)
+    except Exception as e:
+        send(context, chat_id, f"⚠️ Error: {e}")
+        _end_session(job, user_id)
+        return
 
-        # If we get here, timeout occurred
-        update.message.reply_text("📭 No new messages arrived in 15 minutes. Try again later.")
-        # Clear session
-        if user_id in active_sessions:
-            del active_sessions[user_id]
+    # If we get here well after the deadline, the session was lost
+    if time.time() >= data['deadline'] + POLL_INTERVAL * 3:
+        if not data['cursor']:
+            send(context, chat_id, "📭 No new messages arrived in 15 minutes. Try again later.")
+        _end_session(job, user_id)
 
-    except Exception as e:
-        update.message.reply_text(f"⚠️ Error: {e}")
-        # Clear session
-        if user_id in active_sessions:
-            del active_sessions[user_id]
+def _end_session(job, user_id):
+    """Stop a background wait job and clear the user's session."""
+    job.schedule_removal()
+    if user_id in active_sessions:
+        del active_sessions[user_id]
 
 # ───────────────────────────────────────────── #
 # Generate Phone Number (Conversation)
@@ -135,7 +207,7 @@ def generate_email(update: Update, context: CallbackContext):
 def generate_phone_start(update: Update, context: CallbackContext):
     keyboard = [['7 - Russia', '91 - India'], ['380 - Ukraine', '55 - Brazil'], ['Cancel']]
     reply_markup = ReplyKeyboardMarkup(keyboard, one_time_keyboard=True)
-    update.message.reply_text(
+    reply(update, context,
         "📍 Please select a country or enter a country code:",
         reply_markup=reply_markup
     )
@@ -153,112 +225,125 @@ def receive_country_code(update: Update, context: CallbackContext):
     
     # Validate it's a number
     if not country_code.isdigit():
-        update.message.reply_text(
+        reply(update, context,
             "⚠️ Please enter a valid country code (numbers only).",
             reply_markup=ReplyKeyboardRemove()
         )
         return WAITING_FOR_COUNTRY
     
+    status_message = reply(update, context,
+        f"🔍 Generating temporary phone number for country code {country_code}...",
+        reply_markup=ReplyKeyboardRemove()
+    )
+
+    # The provider call can take seconds; keep it off the dispatcher thread so other chats are not held up
+    context.job_queue.run_once(create_number_job, 0, context={
+        'chat_id': update.effective_chat.id,
+        'user_id': user_id,
+        'country_code': country_code,
+        'status_message': status_message,
+    }, name=f"sms-create:{user_id}")
+    return ConversationHandler.END
+
+def create_number_job(context: CallbackContext):
+    """One-off job: create the SMS session chosen in the conversation and start waiting for SMS."""
+    job_data = context.job.context
+    user_id, chat_id, country_code = job_data['user_id'], job_data['chat_id'], job_data['country_code']
+
     # Cancel any existing operation for this user
     if user_id in active_sessions:
         session_id = active_sessions[user_id].get('sms_session')
         if session_id:
-            requests.post(f"{API_BASE_URL}/cancel/{session_id}")
-    
-    # Generate number
-    status_message = update.message.reply_text(
-        f"🔍 Generating temporary phone number for country code {country_code}...",
-        reply_markup=ReplyKeyboardRemove()
-    )
-    
-    response = requests.get(f"{API_BASE_URL}/generate/number?country_id={country_code}")
+            api.cancel(session_id)
 
-    if response.status_code == 200:
-        data = response.json()
+    data, status = api.generate_number(country_code, user=f"tg:{user_id}")
+
+    if status in (429, 503):
+        edit(context, job_data['status_message'], busy_text(status, data))
+    elif status == 200:
         temp_number = data.get("virtual_phone", "Number not found")
         session_id = data.get("session_id")
-        
+
         # Store the session ID
         active_sessions[user_id] = {'sms_session': session_id, 'type': 'sms'}
-        
-        try:
-            update.message.reply_text(
-                f"📱 Temporary Phone Number:\n`{temp_number}`\n\n"
-                "Waiting for incoming SMS... ⏳\n"
-                "Use /cancel to stop waiting.",
-                parse_mode='Markdown'
-            )
-        except Exception as e:
-            print(f"Failed to edit message: {e}")
-
-        # Poll for SMS
-        for attempt in range(30):  # 5 minutes (30 * 10s)
-            sms_response = requests.get(f"{API_BASE_URL}/check_sms/{session_id}")
-            
-            if sms_response.status_code == 200:
-                sms_data = sms_response.json()
-                
-                if sms_data.get("status") == "received":
-                    messages = sms_data.get("messages", [])
-                    
-                    if messages:
-                        # Format the first message
-                        msg = messages[0]
-                        update.message.reply_text(
-                            f"📩 New SMS Received!\n\n"
-                            f"From: {msg.get('from', 'Unknown')}\n"
-                            f"Message: {msg.get('message', 'No content')}\n"
-                            f"Time: {msg.get('time', 'Unknown')}"
-                        )
-                        
-                        # Handle additional messages if present
-                        if len(messages) > 1:
-                            update.message.reply_text(f"➕ {len(messages)-1} more messages received.")
-                        
-                        # Clear session
-                        if user_id in active_sessions:
-                            del active_sessions[user_id]
-                        return ConversationHandler.END
-                elif sms_data.get("status") == "timeout":
-                    update.message.reply_text("📭 No SMS received in 5 minutes. Try again later.")
-                    # Clear session
-                    if user_id in active_sessions:
-                        del active_sessions[user_id]
-                    return ConversationHandler.END
+
+        send(context, chat_id,
+            f"📱 Temporary Phone Number:\n`{temp_number}`\n\n"
+            "Waiting for incoming SMS... ⏳\n"
+            "Use /cancel to stop waiting.",
+            parse_mode='Markdown'
+        )
+
+        # Wait for SMS in the background so the webhook is not held up
+        context.job_queue.run_repeating(
+            check_sms_job,
+            interval=POLL_INTERVAL,
+            first=POLL_INTERVAL,
+            context={
+                'chat_id': chat_id,
+                'user_id': user_id,
+                'session_id': session_id,
+                'cursor': 0,
+                'deadline': time.time() + SMS_WAIT_SECONDS,
+            },
+            name=f"sms:{user_id}"
+        )
+    else:
+        send(context, chat_id, f"❌ Failed to generate number.\nAPI Response: {data}")
+
+def check_sms_job(context: CallbackContext):
+    """Background job: forward new SMS to the chat until the session ends."""
+    job = context.job
+    data = job.context
+    user_id, session_id, chat_id = data['user_id'], data['session_id'], data['chat_id']
+
+    # Check if user has cancelled or started a new operation
+    if user_id not in active_sessions or active_sessions[user_id].get('sms_session') != session_id:
+        job.schedule_removal()
+        return
+
+    try:
+        # Only fetch messages we have not forwarded yet
+        sms_data, status = api.check_sms(session_id, since=data['cursor'])
+
+        if status == 200:
+            for msg in sms_data.get("messages", []):
+                send(context,
+                    chat_id,
+                    f"📩 New SMS Received!\n\n"
+                    f"From: {msg.get('from', 'Unknown')}\n"
+                    f"Message: {msg.get('message', 'No content')}\n"
+                    f"Time: {msg.get('time', 'Unknown')}"
+                )
+            data['cursor'] = sms_data.get("cursor", data['cursor'])
+
+            if sms_data.get("done"):
+                if sms_data.get("status") == "timeout":
+                    send(context, chat_id, "📭 No SMS received in 5 minutes. Try again later.")
                 elif sms_data.get("status") == "error":
-                    update.message.reply_text(f"⚠️ Error: {sms_data.get('message', 'Unknown error')}")
-                    # Clear session
-                    if user_id in active_sessions:
-                        del active_sessions[user_id]
-                    return ConversationHandler.END
+                    send(context, chat_id, f"⚠️ Error: {sms_data.get('message', 'Unknown error')}")
                 elif sms_data.get("status") == "cancelled":
                     # Already handled by cancel function
-                    return ConversationHandler.END
-            
-            # Check if user has cancelled
-            if user_id not in active_sessions or active_sessions[user_id].get('sms_session') != session_id:
-                return ConversationHandler.END
-                
-            time.sleep(10)
-
-        # If we get here, timeout occurred
-        update.message.reply_text("📭 No SMS received in 5 minutes. Try again later.")
-        # Clear session
-        if user_id in active_sessions:
-            del active_sessions[user_id]
-    else:
-        update.message.reply_text(
-            f"❌ Failed to generate number.\nAPI Response: {response.text}",
-            reply_markup=ReplyKeyboardRemove()
-        )
+                    job.schedule_removal()
+                    return
+                _end_session(job, user_id)
+                return
+    except Exception as e:
+        send(context, chat_id, f"⚠️ Error: {e}")
+        _end_session(job, user_id)
+        return
 
-    return ConversationHandler.END
+    # If we get here well after the deadline, the session was lost
+    if time.time() >= data['deadline'] + POLL_INTERVAL * 3:
+        if not data['cursor']:
+            send(context, chat_id, "📭 No SMS received in 5 minutes. Try again later.")
+        _end_session(job, user_id)
 
 def cancel_command(update: Update, context: CallbackContext):
     user_id = update.effective_user.id
     
     if user_id not in active_sessions:
-        update.message.reply_text("❓ No active operation to cancel.")
+        reply(update, context, "❓ No active operation to cancel.")
         return ConversationHandler.END
     
     session_info = active_sessions[user_id]
@@ -267,21 +352,21 @@ def cancel_command(update: Update, context: CallbackContext):
         email = session_info.get('email')
         if email:
             # Cancel on server
-            requests.post(f"{API_BASE_URL}/cancel/{email}")
-            update.message.reply_text("✅ Email monitoring cancelled.")
+            api.cancel(email)
+            reply(update, context, "✅ Email monitoring cancelled.")
     elif session_info.get('type') == 'sms':
         session_id = session_info.get('sms_session')
         if session_id:
             # Cancel on server
-            requests.post(f"{API_BASE_URL}/cancel/{session_id}")
-            update.message.reply_text("✅ SMS monitoring cancelled.")
+            api.cancel(session_id)
+            reply(update, context, "✅ SMS monitoring cancelled.")
     
     # Clear the session
     del active_sessions[user_id]
     return ConversationHandler.END
 
 def cancel_conversation(update: Update, context: CallbackContext):
-    update.message.reply_text(
+    reply(update, context,
         "❌ Operation cancelled.",
         reply_markup=ReplyKeyboardRemove()
     )
@@ -289,19 +374,70 @@ def cancel_conversation(update: Update, context: CallbackContext):
 
 def error_handler(update, context):
     """Log errors caused by Updates."""
-    print(f"Error occurred: {context.error}")
+    logger.error("Error while handling update", exc_info=context.error)
+
+# ───────────────────────────────────────────── #
+# Dispatcher (built once per process)
+# ───────────────────────────────────────────── #
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+_outbox = None
+_outbox_lock = threading.Lock()
+
+registry.gauge("tempgen_outbox_pending", "Outbound Telegram messages waiting to be sent",
+               lambda: _outbox.pending() if _outbox is not None else 0)
+
+WEBHOOK_UPDATE_SECONDS = registry.histogram(
+    "tempgen_webhook_update_seconds", "Time the dispatcher spends handling one webhook update")
+
+class TimedDispatcher(Dispatcher):
+    """Dispatcher that records how long each update takes to handle.
+
+    Once a queued command has been handled, and any conversation it started
+    is in place, the sender is taken off ``queued_commands``.
+    """
+
+    queued_commands = None
+    stopped = False
+
+    def stop(self):
+        self.stopped = True
+        super().stop()
+
+    def process_update(self, update):
+        started = time.perf_counter()
+        try:
+            super().process_update(update)
+        finally:
+            WEBHOOK_UPDATE_SECONDS.observe(time.perf_counter() - started)
+            message = update.message if isinstance(update, Update) else None
+            if self.queued_commands is not None and message and (message.text or "").startswith("/"):
+                self.queued_commands.done((message.chat_id, message.from_user and message.from_user.id))
+
+def get_outbox(bot):
+    """Return the process-wide outbox, so every dispatcher shares one set of send limits."""
+    global _outbox
+    if _outbox is None:
+        with _outbox_lock:
+            if _outbox is None:
+                _outbox = Outbox(bot, TELEGRAM_RATE, TELEGRAM_CHAT_RATE, TELEGRAM_CHAT_BURST, BOT_SEND_WORKERS)
+    return _outbox
+
+def build_dispatcher(bot):
+    """Create a dispatcher with every bot handler registered.
+
+    The dispatcher is not started; see get_dispatcher.
+    """
+    job_queue = JobQueue()
+    dispatcher = TimedDispatcher(bot, Queue(), workers=BOT_WORKERS, job_queue=job_queue, use_context=True)
+    job_queue.set_dispatcher(dispatcher)
+    dispatcher.bot_data["outbox"] = get_outbox(bot)
 
-# Process webhook updates
-def process_update(update_json, bot):
-    """Process incoming webhook update."""
-    update = Update.de_json(update_json, bot)
-    dispatcher = Dispatcher(bot, None, workers=0, use_context=True)
-    
     # Register handlers
     dispatcher.add_error_handler(error_handler)
     dispatcher.add_handler(CommandHandler("start", start))
     dispatcher.add_handler(CommandHandler("help", help_command))
-    dispatcher.add_handler(CommandHandler("generate_email", generate_email))
+    dispatcher.add_handler(CommandHandler("generate_email", generate_email, run_async=True))
     dispatcher.add_handler(CommandHandler("cancel", cancel_command))
 
     phone_conv_handler = ConversationHandler(
@@ -314,7 +450,222 @@ def process_update(update_json, bot):
         },
         fallbacks=[CommandHandler("cancel", cancel_conversation)]
     )
+    # Keep conversation state in the shared backend so any worker can continue it
+    phone_conv_handler.conversations = get_backend().mapping("conversations")
     dispatcher.add_handler(phone_conv_handler)
 
-    # Process the update
-    dispatcher.process_update(update)
\ No newline at end of file
+    # Used by the webhook pre-filter
+    dispatcher.commands = handled_commands(dispatcher)
+    dispatcher.conversations = phone_conv_handler.conversations
+    dispatcher.queued_commands = QueuedCommands()
+    return dispatcher
+
+def run_dispatcher(dispatcher):
+    """Run the dispatcher's update loop, restarting it whenever it dies until ``stop`` is called.
+
+    ``Dispatcher.start`` calls getMe before it sets ``running``, so an
+    unreachable Telegram API would otherwise leave updates queued forever.
+    """
+    delay = 1
+    while not dispatcher.stopped:
+        began = time.monotonic()
+        try:
+            dispatcher.start()
+        except Exception:
+            logger.exception("Dispatcher stopped unexpectedly")
+        if dispatcher.stopped:
+            return
+        if time.monotonic() - began > 60:
+            delay = 1  # it ran for a while; this is a fresh failure
+        time.sleep(delay)
+        delay = min(delay * 2, 60)
+
+def dispatcher_running():
+    """True once the dispatcher is consuming updates; checked by the readiness endpoint."""
+    return _dispatcher is not None and _dispatcher.running
+
+def get_dispatcher(bot):
+    """Return the process-wide dispatcher, building and starting it on first use.
+
+    Reusing one dispatcher keeps ConversationHandler state between updates.
+    Updates are consumed from its update queue by a background thread, and
+    long waits run on its job queue.
+    """
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                dispatcher = build_dispatcher(bot)
+                threading.Thread(target=run_dispatcher, args=(dispatcher,), name="dispatcher", daemon=True).start()
+                dispatcher.job_queue.start()
+                _dispatcher = dispatcher
+    return _dispatcher
+
+# ───────────────────────────────────────────── #
+# Webhook pre-filter
+# ───────────────────────────────────────────── #
+WEBHOOK_UPDATES = registry.counter(
+    "tempgen_webhook_updates_total", "Webhook updates by outcome (dispatched, filtered, duplicate, overloaded)",
+    ("result",))
+
+class RecentIds:
+    """Bounded set of the most recently seen update ids."""
+
+    def __init__(self, size):
+        self._size = size
+        self._ids = set()
+        self._order = deque()
+        self._lock = threading.Lock()
+
+    def add(self, update_id):
+        """Remember ``update_id``. Returns False if it was already seen."""
+        with self._lock:
+            if update_id in self._ids:
+                return False
+            self._ids.add(update_id)
+            self._order.append(update_id)
+            if len(self._order) > self._size:
+                self._ids.discard(self._order.popleft())
+            return True
+
+recent_updates = RecentIds(BOT_DEDUPE_SIZE)
+
+# A redelivery may reach another worker, so with a shared backend the ids are recorded there too
+shared_updates = get_backend().mapping("update_ids") if get_backend().shared else None
+
+def first_delivery(update_id):
+    """True the first time any worker sees ``update_id``."""
+    if not recent_updates.add(update_id):
+        return False
+    return shared_updates is None or shared_updates.add(update_id, True, BOT_DEDUPE_TTL)
+
+class QueuedCommands:
+    """Commands per (chat_id, user_id) that were queued but not yet processed by the dispatcher."""
+
+    def __init__(self):
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def add(self, key):
+        with self._lock:
+            self._counts[key] = self._counts.get(key, 0) + 1
+
+    def done(self, key):
+        with self._lock:
+            count = self._counts.get(key, 0) - 1
+            if count > 0:
+                self._counts[key] = count
+            else:
+                self._counts.pop(key, None)
+
+    def __contains__(self, key):
+        return key in self._counts
+
+def sender(message):
+    return ((message.get("chat") or {}).get("id"), (message.get("from") or {}).get("id"))
+
+def handled_commands(dispatcher):
+    """Every command name a registered handler responds to, including conversation steps."""
+    commands = set()
+
+    def walk(handlers):
+        for handler in handlers:
+            if isinstance(handler, CommandHandler):
+                commands.update(handler.command)
+            elif isinstance(handler, ConversationHandler):
+                walk(handler.entry_points)
+                walk(handler.fallbacks)
+                for state_handlers in handler.states.values():
+                    walk(state_handlers)
+
+    for group in dispatcher.handlers.values():
+        walk(group)
+    return commands
+
+def is_relevant(update_json, dispatcher):
+    """Cheap check on the raw update: could any handler act on it?"""
+    message = update_json.get("message")
+    if not isinstance(message, dict):
+        return False  # edited messages, channel posts, callback queries...
+    text = message.get("text")
+    if not text:
+        return False
+    if text.startswith("/"):
+        command = text[1:].split(None, 1)[0].split("@", 1)[0].lower() if len(text) > 1 else ""
+        return command in dispatcher.commands
+    # Plain text only matters mid-conversation (choosing a country), or once a
+    # command still waiting in the queue has started one
+    key = sender(message)
+    return key in dispatcher.queued_commands or key in dispatcher.conversations
+
+# Process webhook updates
+def process_update(update_json, bot):
+    """Queue an incoming webhook update for the dispatcher and return immediately.
+
+    Re-deliveries and updates no handler would act on are dropped before any
+    Telegram objects are built. With the dispatcher too far behind the update
+    is refused, and not remembered, so Telegram's redelivery is processed.
+    Returns "dispatched", "filtered", "duplicate" or "overloaded".
+    """
+    dispatcher = get_dispatcher(bot)
+    update_id = update_json.get("update_id")
+    if dispatcher.update_queue.qsize() >= BOT_MAX_QUEUED_UPDATES:
+        result = "overloaded"
+    elif update_id is not None and not first_delivery(update_id):
+        result = "duplicate"
+    elif not is_relevant(update_json, dispatcher):
+        result = "filtered"
+    else:
+        if update_json["message"]["text"].startswith("/"):
+            dispatcher.queued_commands.add(sender(update_json["message"]))
+        dispatcher.update_queue.put(Update.de_json(update_json, dispatcher.bot))
+        result = "dispatched"
+    WEBHOOK_UPDATES.inc(result)
+    return result
+
+# ───────────────────────────────────────────── #
+# Warm restart
+# ───────────────────────────────────────────── #
+WAIT_JOBS = {"email": check_email_job, "sms": check_sms_job}
+
+def export_state():
+    """Snapshot per-user sessions and background wait jobs as JSON-ready data."""
+    jobs = []
+    if _dispatcher is not None:
+        callbacks = {callback: kind for kind, callback in WAIT_JOBS.items()}
+        for job in _dispatcher.job_queue.jobs():
+            kind = callbacks.get(job.callback)
+            if kind and not job.removed:
+                jobs.append({"kind": kind, "name": job.name, "context": dict(job.context)})
+    # Pairs rather than an object so integer user ids survive JSON
+    return {"active_sessions": [[user_id, info] for user_id, info in active_sessions.items()], "jobs": jobs}
+
+def import_state(bot, snapshot):
+    """Restore ``export_state`` data and restart its wait jobs, spread over one poll interval."""
+    for user_id, info in snapshot.get("active_sessions", []):
+        user_id = int(user_id)
+        if user_id not in active_sessions:
+            active_sessions[user_id] = info
+    if not snapshot.get("jobs"):
+        return 0
+    job_queue = get_dispatcher(bot).job_queue
+    existing = {job.name for job in job_queue.jobs()}
+    for job in snapshot["jobs"]:
+        if job["name"] in existing:
+            continue
+        job_queue.run_repeating(WAIT_JOBS[job["kind"]], interval=POLL_INTERVAL,
+                                first=random.uniform(0, POLL_INTERVAL), context=job["context"], name=job["name"])
+    return len(snapshot["jobs"])
+
+def drain(timeout):
+    """Stop the wait jobs, give queued replies up to ``timeout`` seconds, and return the state to checkpoint."""
+    if _dispatcher is not None:
+        # Pause first so no job advances its cursor after the snapshot
+        for job in _dispatcher.job_queue.jobs():
+            job.enabled = False
+    snapshot = export_state()
+    if _dispatcher is not None:
+        _dispatcher.job_queue.stop()
+    if _outbox is not None:
+        _outbox.stop(timeout)
+    return snapshot
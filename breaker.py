@@ -0,0 +1,133 @@
+# breaker.py (Provider Circuit Breaker)
+import logging
+import threading
+import time
+from collections import deque
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+STATE_CODES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+# Seconds callers are asked to wait while a half-open probe is in flight
+PROBE_RETRY_AFTER = 1
+
+CIRCUIT_TRANSITIONS = registry.counter(
+    "tempgen_circuit_transitions_total", "Provider circuit breaker state changes", ("provider", "state"))
+
+
+class CircuitOpen(Exception):
+    """A provider call was refused because its circuit is open."""
+
+    def __init__(self, provider, retry_after):
+        super().__init__(f"{provider} provider unavailable (circuit open)")
+        self.provider = provider
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Stops calling a provider that keeps failing, and probes it until it recovers.
+
+    Outcomes of the last ``window`` calls are kept; an error, a 5xx or a call
+    slower than ``slow_call`` seconds counts as a failure. Once at least
+    ``min_calls`` are recorded and the share of failures reaches
+    ``failure_rate``, the circuit opens and ``before`` raises CircuitOpen
+    for ``open_for`` seconds. After that it is half-open: one probe call
+    goes through, closing the circuit if it succeeds or reopening it if not.
+    """
+
+    def __init__(self, name, window=20, min_calls=5, failure_rate=0.5, slow_call=5, open_for=30):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call = slow_call
+        self.open_for = open_for
+        self._outcomes = deque(maxlen=window)  # True for a failed call
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.rejected = 0
+
+    def before(self):
+        """Admit a call, or raise CircuitOpen. Returns True if the call is the half-open probe."""
+        with self._lock:
+            wait = self._wait(time.monotonic())
+            if wait:
+                self.rejected += 1
+                raise CircuitOpen(self.name, wait)
+            if self._state == HALF_OPEN:
+                self._probing = True
+                return True
+            return False
+
+    def record(self, ok, elapsed, probe=False):
+        """Record a finished call. ``ok`` is False for an error or 5xx response."""
+        failed = not ok or elapsed >= self.slow_call
+        with self._lock:
+            if probe:
+                self._probing = False
+                if failed:
+                    self._open(time.monotonic())
+                else:
+                    self._outcomes.clear()
+                    self._transition(CLOSED)
+                    logger.info("Provider circuit closed", extra={"provider": self.name})
+                return
+            if self._state != CLOSED:
+                return  # a call started before the circuit opened
+            self._outcomes.append(failed)
+            failures = sum(self._outcomes)
+            if len(self._outcomes) >= self.min_calls and failures >= self.failure_rate * len(self._outcomes):
+                logger.warning("Provider circuit opened",
+                               extra={"provider": self.name, "failures": failures, "calls": len(self._outcomes)})
+                self._open(time.monotonic())
+
+    def retry_after(self):
+        """Seconds until a call would be admitted; 0 when it would go through now."""
+        with self._lock:
+            return self._wait(time.monotonic())
+
+    @property
+    def state(self):
+        with self._lock:
+            self._wait(time.monotonic())
+            return self._state
+
+    def status(self):
+        with self._lock:
+            wait = self._wait(time.monotonic())
+            return {
+                "state": self._state,
+                "retry_after": round(wait, 1),
+                "failures": sum(self._outcomes),
+                "calls": len(self._outcomes),
+                "failure_rate": self.failure_rate,
+                "slow_call": self.slow_call,
+                "open_for": self.open_for,
+                "opened": self.opened,
+                "rejected": self.rejected,
+            }
+
+    def _wait(self, now):
+        if self._state == OPEN:
+            remaining = self._opened_at + self.open_for - now
+            if remaining > 0:
+                return remaining
+            self._transition(HALF_OPEN)
+            logger.info("Provider circuit half-open, probing", extra={"provider": self.name})
+        if self._state == HALF_OPEN and self._probing:
+            return PROBE_RETRY_AFTER
+        return 0
+
+    def _open(self, now):
+        self._outcomes.clear()
+        self._opened_at = now
+        self.opened += 1
+        self._transition(OPEN)
+
+    def _transition(self, state):
+        self._state = state
+        CIRCUIT_TRANSITIONS.inc(self.name, state)
@@ -0,0 +1,162 @@
+# checkpoint.py (Warm Restart Checkpoints)
+import atexit
+import glob
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import zlib
+from dotenv import load_dotenv
+import bot
+import service
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Load checkpoint settings (set CHECKPOINT_DIR to an empty string to disable)
+CHECKPOINT_DIR = os.getenv("CHECKPOINT_DIR", "checkpoints")
+CHECKPOINT_INTERVAL = float(os.getenv("CHECKPOINT_INTERVAL", 30))   # seconds between periodic writes
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", 5))               # seconds to flush queued replies
+
+FORMAT_VERSION = 1
+
+
+def encode(snapshot):
+    return zlib.compress(json.dumps(snapshot, separators=(",", ":")).encode(), 6)
+
+
+def decode(blob):
+    return json.loads(zlib.decompress(blob))
+
+
+def collect(sessions=None, bot_state=None):
+    return {
+        "version": FORMAT_VERSION,
+        "written_at": time.time(),
+        "sessions": service.export_sessions() if sessions is None else sessions,
+        "bot": bot.export_state() if bot_state is None else bot_state,
+    }
+
+
+class Checkpointer:
+    """Writes this process's sessions to ``checkpoint-<host>-<pid>.z`` and claims files left by dead ones.
+
+    Files are zlib-compressed JSON and are replaced atomically. A starting
+    process claims another process's file by renaming it, so each
+    checkpoint is resumed by exactly one worker; files whose writer is
+    still running on this host are left alone.
+    """
+
+    def __init__(self, directory, interval):
+        self.directory = directory
+        self.interval = interval
+        self.host = socket.gethostname()
+        self.path = os.path.join(directory, f"checkpoint-{self.host}-{os.getpid()}.z")
+        self._stop = threading.Event()
+        self._thread = None
+        self._write_lock = threading.Lock()
+
+    def write(self, snapshot):
+        with self._write_lock:
+            return self._write(snapshot)
+
+    def _write(self, snapshot):
+        if not snapshot["sessions"] and not snapshot["bot"]["jobs"] and not snapshot["bot"]["active_sessions"]:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+            return 0
+        os.makedirs(self.directory, exist_ok=True)
+        blob = encode(snapshot)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(blob)
+        os.replace(tmp, self.path)
+        return len(blob)
+
+    def claim(self):
+        """Yield the snapshots left by processes that are no longer running."""
+        for path in sorted(glob.glob(os.path.join(self.directory, "checkpoint-*.z"))):
+            if path == self.path or self._writer_alive(path):
+                continue
+            claimed = f"{path}.{os.getpid()}.loading"
+            try:
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                continue  # another worker got it first
+            try:
+                with open(claimed, "rb") as f:
+                    snapshot = decode(f.read())
+                if snapshot.get("version") == FORMAT_VERSION:
+                    yield snapshot
+            except (OSError, ValueError, zlib.error):
+                logger.exception("Unreadable checkpoint", extra={"path": path})
+            finally:
+                os.remove(claimed)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="checkpoint", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.write(collect())
+            except Exception:
+                logger.exception("Periodic checkpoint failed")
+
+    def _writer_alive(self, path):
+        host, _, pid = os.path.basename(path)[len("checkpoint-"):-len(".z")].rpartition("-")
+        if host != self.host or not pid.isdigit():
+            return False  # written on another machine (a previous deploy)
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+
+_checkpointer = None
+_lock = threading.Lock()
+_drained = False
+
+
+def init(get_bot):
+    """Resume checkpoints left by previous processes, then checkpoint periodically. Idempotent."""
+    global _checkpointer
+    if not CHECKPOINT_DIR:
+        return
+    with _lock:
+        if _checkpointer is not None:
+            return
+        _checkpointer = Checkpointer(CHECKPOINT_DIR, CHECKPOINT_INTERVAL)
+        for snapshot in _checkpointer.claim():
+            sessions = service.import_sessions(snapshot["sessions"])
+            jobs = bot.import_state(get_bot(), snapshot["bot"])
+            logger.info("Resumed checkpoint", extra={"sessions": sessions, "bot_jobs": jobs,
+                                                     "age": round(time.time() - snapshot["written_at"], 1)})
+        _checkpointer.start()
+        atexit.register(shutdown)
+
+
+def shutdown():
+    """Drain and write the final checkpoint. Safe to call more than once."""
+    global _drained
+    with _lock:
+        if _checkpointer is None or _drained:
+            return
+        _drained = True
+        _checkpointer.stop()
+        bot_state = bot.drain(DRAIN_TIMEOUT)
+        snapshot = collect(service.drain_sessions(), bot_state)
+        size = _checkpointer.write(snapshot)
+        logger.info("Wrote shutdown checkpoint", extra={"sessions": len(snapshot["sessions"]),
+                                                        "bot_jobs": len(snapshot["bot"]["jobs"]), "bytes": size})
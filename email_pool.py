@@ -0,0 +1,117 @@
+# email_pool.py (Pre-warmed Email Pool)
+import logging
+import threading
+import time
+from collections import deque
+from breaker import CircuitOpen
+
+logger = logging.getLogger(__name__)
+
+
+class EmailPool:
+    """Pool of ready temporary email addresses, refilled by a background thread.
+
+    When the pool drops below ``low`` addresses, the refill thread creates new
+    ones until it holds ``high``. Addresses older than ``max_age`` seconds are
+    discarded instead of being handed out. A ``high`` of 0 disables the pool.
+    """
+
+    def __init__(self, create, low=2, high=5, max_age=600, retry_delay=30):
+        self._create = create
+        self.low = low
+        self.high = high
+        self.max_age = max_age
+        self.retry_delay = retry_delay
+        self._items = deque()  # (address, created_at), oldest first
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.created = 0
+        self.failures = 0
+
+    @property
+    def enabled(self):
+        return self.high > 0
+
+    def start(self):
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="email-pool", daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+
+    def acquire(self):
+        """Return a ready address, or None on a miss (the caller creates one itself)."""
+        if not self.enabled:
+            return None
+        self.start()
+        now = time.time()
+        address = None
+        with self._lock:
+            while self._items:
+                candidate, created_at = self._items.popleft()
+                if now - created_at < self.max_age:
+                    address = candidate
+                    break
+                self.expired += 1
+            if address is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            if len(self._items) < self.low:
+                self._wakeup.set()
+        return address
+
+    def size(self):
+        return len(self._items)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._items),
+                "low": self.low,
+                "high": self.high,
+                "hits": self.hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "created": self.created,
+                "failures": self.failures,
+            }
+
+    def _prune(self, now):
+        with self._lock:
+            while self._items and now - self._items[0][1] >= self.max_age:
+                self._items.popleft()
+                self.expired += 1
+
+    def _run(self):
+        while True:
+            # Wake up on demand, and periodically to replace aged-out addresses
+            self._wakeup.wait(timeout=self.max_age / 2)
+            self._wakeup.clear()
+            self._prune(time.time())
+            while self.size() < self.high:
+                try:
+                    address = self._create()
+                except CircuitOpen as e:
+                    # The provider is down: wait until its circuit lets a probe through
+                    logger.warning("Email pool refill paused, provider unavailable",
+                                   extra={"retry_after": round(e.retry_after, 1)})
+                    self.failures += 1
+                    time.sleep(e.retry_after)
+                    break
+                except Exception:
+                    logger.exception("Email pool refill failed")
+                    address = None
+                if not address:
+                    self.failures += 1
+                    time.sleep(self.retry_delay)
+                    break
+                with self._lock:
+                    self._items.append((address, time.time()))
+                    self.created += 1
@@ -0,0 +1,10 @@
+# gunicorn.conf.py (Gunicorn Settings)
+
+# Time a worker gets after SIGTERM to finish requests and drain
+graceful_timeout = 30
+
+
+def worker_exit(server, worker):
+    """Drain the exiting worker and write its warm-restart checkpoint."""
+    import checkpoint
+    checkpoint.shutdown()
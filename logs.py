@@ -0,0 +1,165 @@
+# logs.py (Structured Logging)
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Load logging settings
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")                 # json or text
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))     # records buffered before dropping
+LOG_SAMPLE_SECONDS = float(os.getenv("LOG_SAMPLE_SECONDS", 60))  # one sampled record per key per window
+LOG_BODIES = os.getenv("LOG_BODIES", "redact")               # redact, truncate or full
+LOG_BODY_LIMIT = int(os.getenv("LOG_BODY_LIMIT", 80))        # characters kept when truncating
+
+# Fields that may carry message bodies or raw provider responses
+BODY_FIELDS = {"body", "body_text", "body_html", "text", "message", "response", "messages"}
+
+# Attributes every LogRecord has; anything else was passed through ``extra``
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "sample"}
+
+
+def scrub(key, value):
+    """Redact or truncate body fields, descending into lists and dicts."""
+    if isinstance(value, dict):
+        return {k: scrub(k, v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [scrub(key, v) for v in value]
+    if key not in BODY_FIELDS or LOG_BODIES == "full" or not isinstance(value, str):
+        return value
+    if LOG_BODIES == "truncate":
+        return value if len(value) <= LOG_BODY_LIMIT else value[:LOG_BODY_LIMIT] + "…"
+    return f"<{len(value)} chars>"
+
+
+class StructuredFormatter(logging.Formatter):
+    """Formats a record and its ``extra`` fields as one JSON object, or as key=value text."""
+
+    def __init__(self, style="json"):
+        super().__init__()
+        self.json = style == "json"
+
+    def format(self, record):
+        fields = {k: scrub(k, v) for k, v in vars(record).items() if k not in _RECORD_ATTRS}
+        timestamp = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z"
+        if self.json:
+            data = {"ts": timestamp, "level": record.levelname, "logger": record.name,
+                    "msg": record.getMessage(), **fields}
+            if record.exc_text:
+                data["exc"] = record.exc_text
+            return json.dumps(data, default=str, ensure_ascii=False)
+        line = f"{timestamp} {record.levelname} {record.name}: {record.getMessage()}"
+        if fields:
+            line += " " + " ".join(f"{k}={v}" for k, v in fields.items())
+        if record.exc_text:
+            line += "\n" + record.exc_text
+        return line
+
+
+class SampleFilter(logging.Filter):
+    """Passes at most one record per ``sample`` key every ``interval`` seconds.
+
+    Records logged with ``extra={"sample": key}`` are repetitive (one per
+    poll); the rest are dropped and counted, and the next record that gets
+    through carries the count as ``suppressed``. Records without a key are
+    never sampled.
+    """
+
+    def __init__(self, interval):
+        super().__init__()
+        self.interval = interval
+        self._last = {}
+        self._suppressed = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        key = getattr(record, "sample", None)
+        if key is None or self.interval <= 0:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            last = self._last.get(key)
+            if last is not None and now - last < self.interval:
+                self._suppressed[key] = self._suppressed.get(key, 0) + 1
+                return False
+            self._last[key] = now
+            suppressed = self._suppressed.pop(key, 0)
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that never blocks the caller; records are dropped when the queue is full."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Resolve the message and traceback now; formatting happens on the listener thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_handler = None
+_listener = None
+_setup_lock = threading.Lock()
+
+
+def setup_logging():
+    """Route all logging through a bounded queue drained by one background writer. Idempotent."""
+    global _handler
+    with _setup_lock:
+        if _handler is not None:
+            return
+        _handler = NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+        _handler.addFilter(SampleFilter(LOG_SAMPLE_SECONDS))
+        root = logging.getLogger()
+        root.handlers = [_handler]
+        root.setLevel(LOG_LEVEL)
+        _start_listener()
+        atexit.register(_stop_listener)
+        # A forked worker does not inherit the writer thread
+        os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+def _start_listener():
+    global _listener
+    stream = logging.StreamHandler()
+    stream.setFormatter(StructuredFormatter(LOG_FORMAT))
+    _listener = logging.handlers.QueueListener(_handler.queue, stream)
+    _listener.start()
+
+
+def _stop_listener():
+    if _listener is not None and _listener._thread is not None:
+        _listener.stop()
+
+
+def _restart_after_fork():
+    _handler.queue = queue.Queue(LOG_QUEUE_SIZE)
+    _start_listener()
+
+
+def dropped_count():
+    return _handler.dropped if _handler is not None else 0
@@ -1,33 +1,30 @@
 # main.py (Main script)
+import logging
 import os
 import signal
 import sys
 from dotenv import load_dotenv
-from telegram import Bot
 from app import app as flask_app
+from logs import setup_logging
 
 load_dotenv()
-BOT_TOKEN = os.getenv("BOT_TOKEN")
-WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+setup_logging()
+logger = logging.getLogger(__name__)
 
 def signal_handler(sig, frame):
-    print('Exiting gracefully...')
+    logger.info("Exiting gracefully...")
+    # Drain and checkpoint in-flight sessions so the next process resumes them
+    import checkpoint
+    checkpoint.shutdown()
     sys.exit(0)
 
 if __name__ == "__main__":
     # Set up signal handler
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
-    
-    # Set the webhook when starting
-    try:
-        bot = Bot(token=BOT_TOKEN)
-        print(f"Setting webhook to {WEBHOOK_URL}")
-        bot.set_webhook(WEBHOOK_URL)
-        print("Webhook set successfully")
-    except Exception as e:
-        print(f"Failed to set webhook: {e}")
-    
+
+    # The webhook is registered by the background warm-up started when app was imported
+
     # Start Flask app
-    print("Starting Flask server...")
+    logger.info("Starting Flask server...")
     flask_app.run(host="0.0.0.0", port=int(os.getenv("PORT", 5000)), threaded=True)
\ No newline at end of file
@@ -0,0 +1,181 @@
+# metrics.py (Prometheus-style Metrics)
+import threading
+import weakref
+from bisect import bisect_left
+from collections import deque
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class _Shard:
+    """One thread's private metric values. Merged into the registry when the thread ends."""
+    __slots__ = ("values", "__weakref__")
+
+    def __init__(self):
+        self.values = {}
+
+
+class Registry:
+    """Collects metrics without locking on the hot path.
+
+    Each thread (or greenlet) records into its own shard, so an increment is
+    a plain dict update. Shards are summed only when ``render`` is called for
+    a scrape; a finished thread's shard is folded into a retired total.
+    Values are per worker process.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = weakref.WeakSet()
+        self._dead = deque()  # values of finished threads' shards, waiting to be folded into _retired
+        self._retired = {}
+        self._metrics = []
+        self._gauges = []
+
+    def counter(self, name, help, labelnames=()):
+        metric = Counter(self, name, help, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(self, name, help, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name, help, fn, labelnames=()):
+        """Register a gauge read at scrape time: ``fn`` returns a number, or a dict of label tuple -> number."""
+        self._gauges.append((name, help, fn, labelnames))
+
+    def _values(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = _Shard()
+            # A shard can die anywhere, even while this lock is held, so its
+            # finalizer only appends to a deque and never takes the lock
+            finalizer = weakref.finalize(shard, self._dead.append, shard.values)
+            finalizer.atexit = False
+            with self._lock:
+                # Fold in finished shards here too, so memory does not depend on scrapes
+                self._drain()
+                self._shards.add(shard)
+            self._local.shard = shard
+        return shard.values
+
+    def _drain(self):
+        while self._dead:
+            _merge(self._retired, self._dead.popleft())
+
+    def snapshot(self):
+        with self._lock:
+            # The list keeps these shards alive until after the lock is released;
+            # any shard that died before it was taken has its values in _dead
+            shards = list(self._shards)
+            self._drain()
+            totals = {}
+            _merge(totals, self._retired)
+            for shard in shards:
+                _merge(totals, shard.values.copy())
+        del shards
+        return totals
+
+    def render(self):
+        totals = self.snapshot()
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render(totals))
+        for name, help, fn, labelnames in self._gauges:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} gauge")
+            try:
+                value = fn()
+            except Exception:
+                continue
+            if isinstance(value, dict):
+                for labelvalues, v in value.items():
+                    lines.append(f"{name}{_labels(labelnames, labelvalues)} {v}")
+            else:
+                lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+class Counter:
+    def __init__(self, registry, name, help, labelnames):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+
+    def inc(self, *labelvalues, value=1):
+        values = self.registry._values()
+        key = (self.name, labelvalues)
+        values[key] = values.get(key, 0) + value
+
+    def render(self, totals):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for (name, labelvalues), value in totals.items():
+            if name == self.name:
+                yield f"{self.name}{_labels(self.labelnames, labelvalues)} {value}"
+
+
+class Histogram:
+    def __init__(self, registry, name, help, labelnames, buckets):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labelvalues):
+        values = self.registry._values()
+        key = (self.name, labelvalues)
+        counts = values.get(key)
+        if counts is None:
+            # One slot per bucket plus +Inf, then sum and count
+            counts = values[key] = [0] * (len(self.buckets) + 3)
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-2] += value
+        counts[-1] += 1
+
+    def render(self, totals):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for (name, labelvalues), counts in totals.items():
+            if name != self.name:
+                continue
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = bound if bound == "+Inf" else repr(float(bound))
+                yield f"{self.name}_bucket{_labels(self.labelnames + ('le',), labelvalues + (le,))} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labelvalues)} {counts[-2]}"
+            yield f"{self.name}_count{_labels(self.labelnames, labelvalues)} {counts[-1]}"
+
+
+def _merge(into, values):
+    for key, value in values.items():
+        if isinstance(value, list):
+            current = into.get(key)
+            if current is None:
+                into[key] = list(value)
+            else:
+                for i, v in enumerate(value):
+                    current[i] += v
+        else:
+            into[key] = into.get(key, 0) + value
+
+
+def _labels(labelnames, labelvalues):
+    if not labelnames:
+        return ""
+    pairs = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(labelnames, labelvalues))
+    return "{" + pairs + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+# Process-wide registry
+registry = Registry()
@@ -0,0 +1,41 @@
+# notify.py (Session Change Notifications)
+import threading
+from contextlib import contextmanager
+
+
+class Notifier:
+    """Wakes long-poll and SSE waiters when a session entry changes.
+
+    Each waiter registers an Event for the key it watches; ``publish`` sets
+    the events for that key only, so a change never wakes unrelated waiters.
+    Keys with no waiters cost nothing.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._watchers = {}  # key -> set of Events
+
+    @contextmanager
+    def watch(self, key):
+        event = threading.Event()
+        with self._lock:
+            self._watchers.setdefault(key, set()).add(event)
+        try:
+            yield event
+        finally:
+            with self._lock:
+                events = self._watchers.get(key)
+                if events is not None:
+                    events.discard(event)
+                    if not events:
+                        del self._watchers[key]
+
+    def publish(self, key):
+        with self._lock:
+            events = list(self._watchers.get(key, ()))
+        for event in events:
+            event.set()
+
+    def waiter_count(self):
+        with self._lock:
+            return sum(len(events) for events in self._watchers.values())
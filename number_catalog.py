@@ -0,0 +1,131 @@
+# number_catalog.py (Virtual Number Catalog)
+import logging
+import threading
+import time
+from singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+class CountryNumbers:
+    """Cached number list for one country plus its lease bookkeeping."""
+    __slots__ = ("numbers", "fetched_at", "last_used", "leases", "refreshing")
+
+    def __init__(self, numbers, fetched_at):
+        self.numbers = numbers
+        self.fetched_at = fetched_at
+        self.last_used = {}   # number -> time it was last handed out
+        self.leases = {}      # number -> sessions currently using it
+        self.refreshing = False
+
+
+class NumberCatalog:
+    """Per-country cache of provider numbers that hands them out least-recently-used first.
+
+    Lists are cached for ``ttl`` seconds. Once a list is older than
+    ``refresh_after`` seconds it is refreshed in the background while the
+    cached copy keeps serving; an expired list is refetched inline, falling
+    back to the stale copy if the provider call fails. Numbers without an
+    active lease are preferred, so sessions spread across the provider's
+    numbers instead of all sharing the first one.
+    """
+
+    def __init__(self, fetch, ttl=600, refresh_after=480):
+        self._fetch = fetch
+        self.ttl = ttl
+        self.refresh_after = refresh_after
+        self._countries = {}
+        self._lock = threading.Lock()
+        self.flights = SingleFlight()
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.failures = 0
+
+    def lease(self, country_id):
+        """Pick a number for a new session, or None if the country has no numbers."""
+        country_id = str(country_id)
+        entry = self._entry(country_id)
+        if entry is None:
+            return None
+        with self._lock:
+            entry = self._countries.get(country_id, entry)  # a refresh may have replaced it
+            number = min(entry.numbers, key=lambda n: (entry.leases.get(n, 0) > 0, entry.last_used.get(n, 0)))
+            entry.last_used[number] = time.time()
+            entry.leases[number] = entry.leases.get(number, 0) + 1
+        return number
+
+    def release(self, country_id, number):
+        with self._lock:
+            entry = self._countries.get(str(country_id))
+            if entry is None or number not in entry.leases:
+                return
+            entry.leases[number] -= 1
+            if entry.leases[number] <= 0:
+                del entry.leases[number]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "countries": len(self._countries),
+                "numbers": sum(len(e.numbers) for e in self._countries.values()),
+                "leased": sum(len(e.leases) for e in self._countries.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "refreshes": self.refreshes,
+                "failures": self.failures,
+                "fetches_deduplicated": self.flights.shared,
+            }
+
+    def _entry(self, country_id):
+        now = time.time()
+        with self._lock:
+            entry = self._countries.get(country_id)
+            if entry is not None and now - entry.fetched_at < self.ttl:
+                self.hits += 1
+                if now - entry.fetched_at >= self.refresh_after and not entry.refreshing:
+                    entry.refreshing = True
+                    threading.Thread(target=self._refresh, args=(country_id,), daemon=True).start()
+                return entry
+            self.misses += 1
+
+        # Concurrent misses for one country share a single fetch
+        try:
+            numbers = self.flights.do(country_id, lambda: self._fetch(country_id))
+        except Exception:
+            if entry is None:
+                raise
+            logger.warning("Number catalog fetch failed, serving stale list", extra={"country_id": country_id})
+            numbers = None
+        with self._lock:
+            if not numbers:
+                self.failures += 1
+                return entry  # stale copy (or None) when the provider has nothing for us
+            return self._store(country_id, numbers)
+
+    def _refresh(self, country_id):
+        try:
+            numbers = self._fetch(country_id)
+        except Exception:
+            logger.exception("Number catalog refresh failed", extra={"country_id": country_id})
+            numbers = None
+        with self._lock:
+            if numbers:
+                self.refreshes += 1
+                self._store(country_id, numbers)
+            else:
+                self.failures += 1
+                entry = self._countries.get(country_id)
+                if entry is not None:
+                    entry.refreshing = False
+
+    def _store(self, country_id, numbers):
+        """Replace a country's list, keeping usage history for numbers still offered."""
+        entry = CountryNumbers(list(numbers), time.time())
+        old = self._countries.get(country_id)
+        if old is not None:
+            offered = set(entry.numbers)
+            entry.last_used = {n: t for n, t in old.last_used.items() if n in offered}
+            entry.leases = dict(old.leases)
+        self._countries[country_id] = entry
+        return entry
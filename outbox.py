@@ -0,0 +1,307 @@
+# outbox.py (Outbound Telegram Queue)
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from telegram.error import BadRequest, NetworkError, RetryAfter, TelegramError
+from metrics import registry
+from ratelimit import RateBudget
+
+logger = logging.getLogger(__name__)
+
+MAX_MESSAGE_LENGTH = 4096  # Telegram's limit per message
+
+TELEGRAM_SENDS = registry.counter(
+    "tempgen_telegram_sends_total", "Outbound Telegram calls by method and outcome", ("method", "outcome"))
+
+
+def split_text(text, limit=MAX_MESSAGE_LENGTH):
+    """Split text into chunks of at most ``limit`` characters, preferring line breaks."""
+    chunks = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = limit
+        chunks.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    chunks.append(text)
+    return chunks
+
+
+class OutgoingMessage:
+    """Handle for a queued message; ``message_id`` is set once Telegram accepts it."""
+    __slots__ = ("chat_id", "message_id", "failed")
+
+    def __init__(self, chat_id):
+        self.chat_id = chat_id
+        self.message_id = None
+        self.failed = False
+
+
+class _Item:
+    __slots__ = ("method", "message", "text", "kwargs", "attempts")
+
+    def __init__(self, method, message, text, kwargs):
+        self.method = method      # "send" or "edit"
+        self.message = message
+        self.text = text
+        self.kwargs = kwargs
+        self.attempts = 0
+
+
+class _Chat:
+    __slots__ = ("items", "tokens", "updated", "paused_until", "busy", "scheduled", "reserved")
+
+    def __init__(self, burst):
+        self.items = deque()
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.busy = False
+        self.scheduled = False
+        self.reserved = False
+
+
+class Outbox:
+    """Queue of outbound Telegram messages, delivered by a small worker pool.
+
+    Each chat has its own FIFO and token bucket (Telegram allows about one
+    message per second per chat, with short bursts), and a shared RateBudget
+    keeps the bot under the global limit of about 30 messages per second.
+    A chat is served by one worker at a time, so its messages arrive in
+    order. An edit replaces a still-queued send or edit of the same message
+    instead of adding a call, long texts are split at 4096 characters, and
+    a RetryAfter pauses the chat rather than a thread. Callers never wait
+    for Telegram.
+    """
+
+    def __init__(self, bot, rate=30, chat_rate=1, chat_burst=3, workers=4, max_attempts=3):
+        self.bot = bot
+        self.budget = RateBudget(rate, rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_attempts = max_attempts
+        self._chats = {}
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="outbox")
+        self._thread = None
+        self._stopped = False
+        self._last_prune = time.monotonic()
+        self.sent = 0
+        self.coalesced = 0
+        self.split = 0
+        self.retried = 0
+        self.failed = 0
+
+    def start(self):
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="outbox", daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout=5):
+        """Wait up to ``timeout`` seconds for queued messages to go out, then stop."""
+        self.flush(timeout)
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self._pool.shutdown(wait=False)
+
+    def flush(self, timeout):
+        """Block until every queued message was handled. Returns False on timeout."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._pending_locked():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def send(self, chat_id, text, **kwargs):
+        """Queue a message. Returns a handle for the first chunk that ``edit`` can target."""
+        self.start()
+        chunks = split_text(text)
+        reply_markup = kwargs.pop("reply_markup", None)
+        first = None
+        with self._cond:
+            if len(chunks) > 1:
+                self.split += 1
+            for i, chunk in enumerate(chunks):
+                message = OutgoingMessage(chat_id)
+                item_kwargs = dict(kwargs)
+                if reply_markup is not None and i == len(chunks) - 1:
+                    item_kwargs["reply_markup"] = reply_markup
+                self._enqueue(chat_id, _Item("send", message, chunk, item_kwargs))
+                first = first or message
+        return first
+
+    def edit(self, message, text, **kwargs):
+        """Queue an edit of a sent message, coalescing with a pending send or edit of it."""
+        text = text[:MAX_MESSAGE_LENGTH]
+        with self._cond:
+            chat = self._chats.get(message.chat_id)
+            if chat is not None:
+                for item in chat.items:
+                    if item.message is message:
+                        # The send (or an older edit) has not gone out yet: just change its text
+                        item.text = text
+                        item.kwargs.update(kwargs)
+                        self.coalesced += 1
+                        return
+            self._enqueue(message.chat_id, _Item("edit", message, text, kwargs))
+
+    def pending(self):
+        with self._cond:
+            return self._pending_locked()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "pending": self._pending_locked(),
+                "chats": len(self._chats),
+                "sent": self.sent,
+                "coalesced": self.coalesced,
+                "split": self.split,
+                "retried": self.retried,
+                "failed": self.failed,
+                "budget": self.budget.usage(),
+            }
+
+    def _pending_locked(self):
+        return sum(len(chat.items) + chat.busy for chat in self._chats.values())
+
+    def _enqueue(self, chat_id, item):
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = _Chat(self.chat_burst)
+        chat.items.append(item)
+        self._ready(chat_id, chat)
+
+    def _ready(self, chat_id, chat):
+        """Put a chat with queued items on the heap at the time its bucket allows a send."""
+        if not chat.items or chat.busy or chat.scheduled:
+            return
+        now = time.monotonic()
+        self._refill(chat, now)
+        due = max(now, chat.paused_until)
+        if chat.tokens < 1:
+            due = max(due, now + (1 - chat.tokens) / self.chat_rate)
+        chat.scheduled = True
+        heapq.heappush(self._heap, (due, next(self._seq), chat_id))
+        self._cond.notify_all()
+
+    def _refill(self, chat, now):
+        chat.tokens = min(self.chat_burst, chat.tokens + (now - chat.updated) * self.chat_rate)
+        chat.updated = now
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    if self._heap:
+                        wait = self._heap[0][0] - time.monotonic()
+                        if wait <= 0:
+                            break
+                        self._cond.wait(wait)
+                    else:
+                        self._cond.wait()
+                if self._stopped:
+                    return
+                _, _, chat_id = heapq.heappop(self._heap)
+                chat = self._chats[chat_id]
+                chat.scheduled = False
+                # Book a global slot; come back when it is due instead of holding a worker
+                if not chat.reserved:
+                    wait = self.budget.reserve()
+                    if wait:
+                        chat.reserved = True
+                        chat.scheduled = True
+                        heapq.heappush(self._heap, (time.monotonic() + wait, next(self._seq), chat_id))
+                        continue
+                chat.reserved = False
+                chat.busy = True
+                self._prune()
+            try:
+                self._pool.submit(self._deliver, chat_id, chat)
+            except RuntimeError:
+                return  # pool shut down (process exiting)
+
+    def _deliver(self, chat_id, chat):
+        with self._cond:
+            item = chat.items.popleft()
+            self._refill(chat, time.monotonic())
+            chat.tokens -= 1
+        requeue_after = None
+        delivered = False
+        try:
+            self._call(chat_id, item)
+            self.budget.record(200)
+            TELEGRAM_SENDS.inc(item.method, "ok")
+            delivered = True
+        except RetryAfter as e:
+            self.budget.record(429)
+            TELEGRAM_SENDS.inc(item.method, "retry_after")
+            requeue_after = e.retry_after
+        except BadRequest as e:
+            if item.method == "edit" and "not modified" in str(e).lower():
+                TELEGRAM_SENDS.inc(item.method, "ok")
+                delivered = True
+            else:
+                self._drop(item, e)
+        except NetworkError as e:
+            item.attempts += 1
+            if item.attempts < self.max_attempts:
+                TELEGRAM_SENDS.inc(item.method, "retry")
+                requeue_after = item.attempts
+            else:
+                self._drop(item, e)
+        except TelegramError as e:
+            self._drop(item, e)
+        except Exception as e:
+            logger.exception("Unexpected error sending Telegram message", extra={"chat_id": chat_id})
+            self._drop(item, e)
+
+        with self._cond:
+            if requeue_after is not None:
+                self.retried += 1
+                chat.items.appendleft(item)
+                chat.paused_until = time.monotonic() + requeue_after
+            elif delivered:
+                self.sent += 1
+            chat.busy = False
+            self._ready(chat_id, chat)
+            self._cond.notify_all()
+
+    def _call(self, chat_id, item):
+        message = item.message
+        if item.method == "edit" and message.message_id is not None:
+            self.bot.edit_message_text(item.text, chat_id=chat_id, message_id=message.message_id, **item.kwargs)
+            return
+        # A send, or an edit whose original never went out: deliver it as a new message
+        result = self.bot.send_message(chat_id, item.text, **item.kwargs)
+        message.message_id = result.message_id
+        message.failed = False
+
+    def _drop(self, item, error):
+        self.failed += 1
+        item.message.failed = True
+        TELEGRAM_SENDS.inc(item.method, "failed")
+        logger.warning("Dropped Telegram message", extra={"chat_id": item.message.chat_id,
+                                                          "method": item.method, "error": str(error)})
+
+    def _prune(self, idle=60):
+        """Forget idle chats whose bucket has refilled, so the map does not grow without bound."""
+        now = time.monotonic()
+        if now - self._last_prune < idle:
+            return
+        self._last_prune = now
+        for chat_id, chat in list(self._chats.items()):
+            if (not chat.items and not chat.busy and not chat.scheduled and now > chat.paused_until
+                    and now - chat.updated > self.chat_burst / self.chat_rate):
+                del self._chats[chat_id]
@@ -0,0 +1,155 @@
+# poller.py (Poll Engine)
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class PollSession:
+    """One email or SMS session waiting for messages."""
+    __slots__ = ("key", "kind", "params", "deadline", "next_due", "cancelled")
+
+    def __init__(self, key, kind, params, deadline, next_due):
+        self.key = key
+        self.kind = kind
+        self.params = params
+        self.deadline = deadline
+        self.next_due = next_due
+        self.cancelled = False
+
+
+class PollEngine:
+    """Runs poll steps for many sessions from one timer thread and a small worker pool.
+
+    Each session is a small record in a heap ordered by its next due time; no
+    thread sleeps on behalf of a session. Handlers are registered per kind:
+
+    - ``step(session)`` polls once and returns the seconds until the next poll,
+      or ``None`` when the session is finished.
+    - ``on_timeout(session)`` is called once the session's deadline passes.
+    - ``on_done(session)``, if given, is called once when the session ends for
+      any reason, including cancellation.
+    """
+
+    def __init__(self, workers=16):
+        self._handlers = {}
+        self._sessions = {}
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="poller")
+        self._thread = None
+        self._stopped = False
+
+    def register(self, kind, step, on_timeout, on_done=None):
+        self._handlers[kind] = (step, on_timeout, on_done)
+
+    def start(self):
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="poll-engine", daemon=True)
+                self._thread.start()
+
+    def stop(self, wait=False):
+        """Stop scheduling steps. With ``wait``, block until in-flight steps have returned."""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self._pool.shutdown(wait=wait)
+
+    def schedule(self, key, kind, params, timeout, delay=0):
+        """Start polling ``key``; an already active session with the same key is reused."""
+        return self.schedule_many([(key, kind, params, timeout)], delay)[0]
+
+    def schedule_many(self, items, delay=0):
+        """Start polling several (key, kind, params, timeout) sessions under one lock acquisition."""
+        self.start()
+        now = time.time()
+        scheduled = []
+        with self._cond:
+            for key, kind, params, timeout in items:
+                session = self._sessions.get(key)
+                if session is None:
+                    session = PollSession(key, kind, params, now + timeout, now + delay)
+                    self._sessions[key] = session
+                    heapq.heappush(self._heap, (session.next_due, next(self._seq), session))
+                scheduled.append(session)
+            self._cond.notify()
+        return scheduled
+
+    def cancel(self, key):
+        """Stop polling ``key``. Its heap entry is dropped when it comes due."""
+        with self._cond:
+            session = self._sessions.pop(key, None)
+            if session is None:
+                return False
+            # Under the lock, so a step finishing now sees it and does not finish the session too
+            session.cancelled = True
+        self._finish(session)
+        return True
+
+    def active_count(self):
+        return len(self._sessions)
+
+    def sessions(self):
+        with self._cond:
+            return list(self._sessions.values())
+
+    def _push(self, session):
+        heapq.heappush(self._heap, (session.next_due, next(self._seq), session))
+        self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    if self._heap:
+                        wait = self._heap[0][0] - time.time()
+                        if wait <= 0:
+                            break
+                        self._cond.wait(wait)
+                    else:
+                        self._cond.wait()
+                if self._stopped:
+                    return
+                _, _, session = heapq.heappop(self._heap)
+            if not session.cancelled:
+                try:
+                    self._pool.submit(self._execute, session)
+                except RuntimeError:
+                    return  # pool shut down (process exiting)
+
+    def _execute(self, session):
+        step, on_timeout, _ = self._handlers[session.kind]
+        try:
+            if time.time() >= session.deadline:
+                on_timeout(session)
+                delay = None
+            else:
+                delay = step(session)
+        except Exception:
+            logger.exception("Poll engine error", extra={"key": session.key})
+            delay = None
+
+        with self._cond:
+            if session.cancelled:
+                return
+            if delay is not None:
+                session.next_due = min(time.time() + delay, session.deadline)
+                self._push(session)
+                return
+            if self._sessions.get(session.key) is session:
+                del self._sessions[session.key]
+        self._finish(session)
+
+    def _finish(self, session):
+        on_done = self._handlers[session.kind][2]
+        if on_done is not None:
+            try:
+                on_done(session)
+            except Exception:
+                logger.exception("Poll engine error finishing session", extra={"key": session.key})
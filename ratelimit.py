@@ -0,0 +1,95 @@
+# ratelimit.py (Provider Rate Budget)
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+
+
+def parse_retry_after(value, default=30):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date)."""
+    if not value:
+        return default
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return default
+
+
+class RateBudget:
+    """Token bucket shared by every session that calls one provider host.
+
+    Background polls call ``reserve``, which books the next free token and
+    returns how long to wait for it, so a poll is rescheduled to its slot
+    instead of blocking or retrying. Interactive calls use ``consume``, which
+    always proceeds but may leave the bucket in debt so that polls yield to
+    users. A 429 pauses the whole host until its Retry-After.
+    Requests are counted per minute for the last hour.
+    """
+
+    def __init__(self, rate, burst, history_minutes=60):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+        self._minutes = deque(maxlen=history_minutes)  # [minute, requests, throttled, deferred]
+
+    def reserve(self):
+        """Book a token. Returns 0 if it can be used now, else the seconds until its slot."""
+        with self._lock:
+            now = self._refill()
+            self._tokens -= 1
+            wait = max(-self._tokens / self.rate, self._paused_until - now, 0)
+            if wait:
+                self._count(deferred=1)
+            return wait
+
+    def consume(self):
+        with self._lock:
+            self._refill()
+            self._tokens -= 1
+
+    def pause(self, seconds):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def paused_for(self):
+        return max(self._paused_until - time.monotonic(), 0)
+
+    def record(self, status_code):
+        with self._lock:
+            self._count(requests=1, throttled=1 if status_code == 429 else 0)
+
+    def usage(self):
+        with self._lock:
+            self._refill()
+            return {
+                "rate_per_minute": self.rate * 60,
+                "burst": self.burst,
+                "tokens": round(self._tokens, 2),
+                "paused_for": round(max(self._paused_until - time.monotonic(), 0), 1),
+                "per_minute": [
+                    {"minute": minute * 60, "requests": requests, "throttled": throttled, "deferred": deferred}
+                    for minute, requests, throttled, deferred in self._minutes
+                ],
+            }
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        return now
+
+    def _count(self, requests=0, throttled=0, deferred=0):
+        minute = int(time.time() // 60)
+        if not self._minutes or self._minutes[-1][0] != minute:
+            self._minutes.append([minute, 0, 0, 0])
+        bucket = self._minutes[-1]
+        bucket[1] += requests
+        bucket[2] += throttled
+        bucket[3] += deferred
@@ -0,0 +1,773 @@
+# service.py (Service Layer)
+import logging
+import math
+import os
+import random
+import secrets
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from dotenv import load_dotenv
+from admission import Admission, Rejected
+from breaker import STATE_CODES, CircuitOpen
+from email_pool import EmailPool
+from metrics import registry
+from notify import Notifier
+from number_catalog import NumberCatalog
+from poller import PollEngine
+from state import get_backend, owner_id
+from upstream import UpstreamClient
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+TEMP_MAIL_API_KEY = os.getenv("TEMP_MAIL_API_KEY")
+VIRTUAL_NUMBER_API_KEY = os.getenv("VIRTUAL_NUMBER_API_KEY")
+
+# Temp-Mail API setup
+TEMP_MAIL_API_HOST = "temp-mail44.p.rapidapi.com"
+TEMP_MAIL_HEADERS = {
+    "x-rapidapi-key": TEMP_MAIL_API_KEY,
+    "x-rapidapi-host": TEMP_MAIL_API_HOST,
+    "Content-Type": "application/json"
+}
+TEMP_MAIL_BASE_URL = os.getenv("TEMP_MAIL_BASE_URL", f"https://{TEMP_MAIL_API_HOST}")
+
+# Virtual Number API setup
+VIRTUAL_NUMBER_API_HOST = "virtual-number.p.rapidapi.com"
+VIRTUAL_NUMBER_HEADERS = {
+    "x-rapidapi-key": VIRTUAL_NUMBER_API_KEY,
+    "x-rapidapi-host": VIRTUAL_NUMBER_API_HOST
+}
+VIRTUAL_NUMBER_BASE_URL = os.getenv("VIRTUAL_NUMBER_BASE_URL", f"https://{VIRTUAL_NUMBER_API_HOST}")
+
+# Request budget per provider host, shared by every session (requests/second, burst)
+TEMP_MAIL_RATE = float(os.getenv("TEMP_MAIL_RATE", 5))
+TEMP_MAIL_BURST = int(os.getenv("TEMP_MAIL_BURST", 10))
+VIRTUAL_NUMBER_RATE = float(os.getenv("VIRTUAL_NUMBER_RATE", 5))
+VIRTUAL_NUMBER_BURST = int(os.getenv("VIRTUAL_NUMBER_BURST", 10))
+
+# Pooled keep-alive clients, one per provider host
+temp_mail_api = UpstreamClient(TEMP_MAIL_BASE_URL, TEMP_MAIL_HEADERS, TEMP_MAIL_RATE, TEMP_MAIL_BURST,
+                               name="temp_mail")
+virtual_number_api = UpstreamClient(VIRTUAL_NUMBER_BASE_URL, VIRTUAL_NUMBER_HEADERS,
+                                    VIRTUAL_NUMBER_RATE, VIRTUAL_NUMBER_BURST, name="virtual_number")
+PROVIDERS = {"temp_mail": temp_mail_api, "virtual_number": virtual_number_api}
+
+# Polling settings: poll fast right after creation, then back off while idle
+POLL_MIN_INTERVAL = float(os.getenv("POLL_MIN_INTERVAL", 2))    # seconds
+POLL_MAX_INTERVAL = float(os.getenv("POLL_MAX_INTERVAL", 30))   # seconds
+POLL_BACKOFF = 1.5
+EMAIL_POLL_TIMEOUT = 15 * 60   # 15 minutes
+SMS_POLL_TIMEOUT = 5 * 60      # 5 minutes
+
+# Long-poll and SSE settings
+MAX_LONG_POLL = int(os.getenv("MAX_LONG_POLL", 60))        # longest allowed ?wait=
+SSE_MAX_DURATION = int(os.getenv("SSE_MAX_DURATION", 900)) # one stream per session lifetime
+SSE_KEEPALIVE = 15                                          # seconds between keep-alive comments
+NOTIFY_RECHECK = 2                                          # re-read shared state this often
+
+# Seconds a worker owns a session between polls before another may take over
+POLL_LEASE = int(os.getenv("POLL_LEASE", 60))
+
+# Pre-warmed email pool (set EMAIL_POOL_HIGH=0 to disable)
+EMAIL_POOL_LOW = int(os.getenv("EMAIL_POOL_LOW", 2))
+EMAIL_POOL_HIGH = int(os.getenv("EMAIL_POOL_HIGH", 5))
+EMAIL_POOL_MAX_AGE = int(os.getenv("EMAIL_POOL_MAX_AGE", 600))   # seconds
+
+# Batch generation (/generate/*/batch and /status/batch)
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", 100))     # items allowed in one batch request
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", 8))   # provider calls in flight across all batches
+
+# Admission control: sessions allowed to poll at once in this worker, in total and per client.
+# Both caps are per worker process, so the service as a whole admits WEB_CONCURRENCY times as many.
+ADMISSION_LIMIT = int(os.getenv("ADMISSION_LIMIT", 200))           # 0 disables the global cap
+ADMISSION_PER_USER = int(os.getenv("ADMISSION_PER_USER", 10))      # 0 disables the per-client cap
+# Batch requests (e.g. a QA harness creating many inboxes) may hold this many sessions per client instead
+ADMISSION_BATCH_PER_USER = int(os.getenv("ADMISSION_BATCH_PER_USER", BATCH_MAX_ITEMS))
+ADMISSION_QUEUE = int(os.getenv("ADMISSION_QUEUE", 50))            # requests allowed to wait for a slot
+ADMISSION_WAIT = float(os.getenv("ADMISSION_WAIT", 2))             # seconds a REST request may wait
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", 5)) # seconds suggested to rejected clients
+
+# Compact views for frequent pollers (?view=compact cuts message bodies to this many characters)
+COMPACT_BODY_CHARS = int(os.getenv("COMPACT_BODY_CHARS", 200))
+
+# Country number catalog cache
+NUMBER_CATALOG_TTL = int(os.getenv("NUMBER_CATALOG_TTL", 600))          # seconds
+NUMBER_CATALOG_REFRESH = int(os.getenv("NUMBER_CATALOG_REFRESH", 480))  # refresh in background after
+
+# Message Cache (shared between workers when STATE_BACKEND=sqlite)
+state = get_backend()
+message_cache = state.mapping("message_cache")
+operation_status = state.mapping("operation_status")
+
+# Wakes long-poll and SSE waiters when an entry changes
+notifier = Notifier()
+
+admission = Admission(ADMISSION_LIMIT, ADMISSION_PER_USER, ADMISSION_QUEUE, ADMISSION_RETRY_AFTER)
+
+ADMISSION_REJECTED = registry.counter(
+    "tempgen_admission_rejected_total", "Session requests turned away by admission control", ("reason",))
+
+SESSION_OUTCOMES = registry.counter(
+    "tempgen_session_outcomes_total", "Finished sessions by kind and outcome", ("kind", "outcome"))
+registry.gauge("tempgen_circuit_state", "Provider circuit state (0 closed, 1 half-open, 2 open)",
+               lambda: {(name,): STATE_CODES[api.breaker.state] for name, api in PROVIDERS.items()}, ("provider",))
+
+def session_kind(key):
+    return "sms" if str(key).startswith("sms_") else "email"
+
+def store_result(key, entry, previous=None):
+    """Store a session's latest state, one version past ``previous``, and wake anyone waiting on it."""
+    entry["version"] = (previous or {}).get("version", 0) + 1
+    message_cache[key] = entry
+    notifier.publish(key)
+
+# Each session entry carries an append-only "messages" log and a "cursor"
+# (the log length). Clients pass ?since=<cursor> to fetch only newer
+# messages. "done" turns true once the session stops polling. "version"
+# goes up on every change and backs the ETag of the polling routes.
+
+def pending_entry(message):
+    return {"status": "pending", "message": message, "messages": [], "cursor": 0, "done": False, "version": 1}
+
+def append_messages(key, new_messages, **extra):
+    """Append newly seen messages to a session's log and publish the change."""
+    entry = message_cache.get(key) or {}
+    messages = entry.get("messages", []) + new_messages
+    store_result(key, dict(extra, status="received", messages=messages, cursor=len(messages), done=False), entry)
+
+def finish_session(key, status, message, **extra):
+    """Mark a session done. A session that already received messages keeps them."""
+    entry = message_cache.get(key) or {}
+    messages = entry.get("messages", [])
+    if messages and status == "timeout":
+        status = "received"
+        operation_status[key] = "complete"
+    else:
+        operation_status[key] = status
+    SESSION_OUTCOMES.inc(session_kind(key), status)
+    store_result(key, dict(extra, status=status, message=message, messages=messages,
+                           cursor=len(messages), done=True), entry)
+
+# ?view= for the polling routes: everything, bodies cut short, or no messages at all
+VIEWS = ("full", "compact", "status")
+STATUS_FIELDS = ("status", "message", "cursor", "done", "version")
+
+def truncate(text):
+    if isinstance(text, str) and len(text) > COMPACT_BODY_CHARS:
+        return text[:COMPACT_BODY_CHARS] + "…"
+    return text
+
+def compact_message(message):
+    """A message with its text cut to COMPACT_BODY_CHARS; ``truncated`` marks a cut."""
+    # Emails carry the text in "body", SMS in "message"
+    field = "body" if "body" in message else "message"
+    text = message.get(field)
+    if not isinstance(text, str) or len(text) <= COMPACT_BODY_CHARS:
+        return message
+    return dict(message, **{field: truncate(text)}, truncated=True)
+
+def session_view(entry, since, view="full"):
+    """Limit an entry's message log to the messages after cursor ``since``, shaped by ``view``."""
+    if view == "status":
+        return {k: entry[k] for k in STATUS_FIELDS if k in entry}
+    if view == "full" and (since <= 0 or not entry.get("messages")):
+        return entry
+    shaped = dict(entry)
+    messages = entry.get("messages", [])
+    shaped["messages"] = messages[since:] if since > 0 else messages
+    if view == "compact":
+        shaped["messages"] = [compact_message(message) for message in shaped["messages"]]
+        if "body" in shaped:
+            shaped["body"] = truncate(shaped["body"])
+    return shaped
+
+def entry_etag(payload, since, view):
+    """ETag of a session view: the entry's version plus what the client asked to see."""
+    return f"{payload.get('version', 0)}-{since}-{view}"
+
+def is_settled(entry, since):
+    """True once a long-poll or stream waiting past cursor ``since`` can return."""
+    return entry.get("done", True) or entry.get("cursor", 0) > since
+
+# ------------------- TEMP EMAIL STUFF ------------------- #
+def generate_temp_email():
+    """Create an address at the provider, or None on failure. Raises CircuitOpen while it is down."""
+    temp_mail_api.budget.consume()
+    try:
+        response = temp_mail_api.post("/api/v3/email/new", endpoint="generate_temp_email")
+    except requests.RequestException as e:
+        logger.warning("Failed to create email", extra={"error": str(e)})
+        return None
+
+    if response.status_code == 200:
+        email_data = response.json()
+        temp_email = email_data.get("email")
+        logger.info("Temporary email created", extra={"email": temp_email})
+        return temp_email
+    else:
+        logger.warning("Failed to create email", extra={"status": response.status_code, "response": response.text})
+        return None
+
+def owns_session(key):
+    """Renew this worker's claim on a session; False once it is cancelled or owned elsewhere."""
+    if operation_status.get(key) == "cancelled":
+        return False
+    return state.claim(key, owner_id(), POLL_LEASE)
+
+def next_interval(session):
+    """Return the current poll interval and back off the next one."""
+    interval = session.params.get("interval", POLL_MIN_INTERVAL)
+    session.params["interval"] = min(interval * POLL_BACKOFF, POLL_MAX_INTERVAL)
+    return interval
+
+def throttled_delay(api, session):
+    """Delay after a 429: the provider's Retry-After, but never less than the session's interval."""
+    return max(api.budget.paused_for(), session.params.get("interval", POLL_MIN_INTERVAL))
+
+def circuit_delay(api, session):
+    """Delay while a provider's circuit is open: until it is due for a probe, spread over the session's interval."""
+    # Jitter keeps every paused session from waking at the same instant
+    return api.breaker.retry_after() + random.uniform(0, session.params.get("interval", POLL_MIN_INTERVAL))
+
+def poll_inbox(session):
+    """Check the inbox once. Returns seconds until the next poll, or None when done."""
+    temp_email = session.key
+    seen_messages = session.params["seen"]
+
+    if not owns_session(temp_email):
+        return None
+
+    # Pause while the provider's circuit is open
+    if temp_mail_api.breaker.retry_after():
+        return circuit_delay(temp_mail_api, session)
+
+    # Come back at our booked slot instead of spending quota over the shared budget
+    if not session.params.pop("reserved", False):
+        wait = temp_mail_api.budget.reserve()
+        if wait:
+            session.params["reserved"] = True
+            return wait
+
+    try:
+        response = temp_mail_api.get(f"/api/v3/email/{temp_email}/messages", endpoint="inbox_fetch")
+
+        if response.status_code == 429:
+            return throttled_delay(temp_mail_api, session)
+        if response.status_code == 200:
+            messages = response.json()
+            logger.debug("Inbox polled", extra={"sample": "inbox_poll", "email": temp_email, "messages": messages})
+            new_messages = []
+            for msg in messages:
+                msg_id = msg.get("id")
+
+                if msg_id not in seen_messages:
+                    seen_messages.add(msg_id)
+                    new_messages.append({
+                        "id": msg_id,
+                        "from": msg.get("from"),
+                        "subject": msg.get("subject"),
+                        "body": msg.get("body_text") or msg.get("body_html") or "No content" 
+                    })
+
+            if new_messages:
+                # Top-level fields keep showing the first message for older clients
+                first = (message_cache.get(temp_email) or {}).get("messages") or new_messages
+                append_messages(temp_email, new_messages,
+                                **{k: first[0][k] for k in ("from", "subject", "body")})
+                logger.info("New email received", extra={"email": temp_email, "count": len(new_messages)})
+                # Keep polling for the rest of the session, starting fast again
+                session.params["interval"] = POLL_MIN_INTERVAL
+        return next_interval(session)
+    except CircuitOpen:
+        return circuit_delay(temp_mail_api, session)
+    except requests.RequestException as e:
+        # Provider trouble: keep the session and let the circuit breaker decide when to back off
+        logger.warning("Inbox poll failed", extra={"email": temp_email, "error": str(e)})
+        return next_interval(session)
+    except Exception as e:
+        logger.exception("Error while polling inbox", extra={"email": temp_email})
+        finish_session(temp_email, "error", str(e))
+        return None
+
+def inbox_timeout(session):
+    # If no messages after 15 minutes
+    finish_session(session.key, "timeout", "No messages received after 15 minutes")
+
+# ------------------- VIRTUAL NUMBER STUFF ------------------- #
+def fetch_country_numbers(country_id):
+    """Fetch a country's full number list from the provider, or None on failure."""
+    querystring = {"countryId": country_id}
+
+    virtual_number_api.budget.consume()
+    try:
+        response = virtual_number_api.get("/api/v1/e-sim/country-numbers", params=querystring,
+                                          endpoint="country_numbers")
+    except requests.RequestException as e:
+        logger.warning("Error fetching numbers", extra={"country_id": country_id, "error": str(e)})
+        return None
+    logger.info("Fetched country numbers", extra={"country_id": country_id, "status": response.status_code})
+    logger.debug("Country numbers response", extra={"country_id": country_id, "response": response.text})
+
+    if response.status_code == 200:
+        phone_data = response.json()
+
+        if isinstance(phone_data, list) and phone_data:
+            return phone_data
+        else:
+            logger.warning("No numbers found", extra={"country_id": country_id})
+            return None
+    else:
+        logger.warning("Error fetching numbers", extra={"country_id": country_id, "status": response.status_code,
+                                                       "response": response.text})
+        return None
+
+def generate_virtual_phone_number(country_id):
+    # Rotate through the cached catalog instead of always taking the first number
+    return number_catalog.lease(country_id)
+
+def release_number(session):
+    number_catalog.release(session.params["country_id"], session.params["phone_number"])
+
+def release_slot(session):
+    admission.release(session.key)
+
+def sms_done(session):
+    release_number(session)
+    release_slot(session)
+
+def poll_sms_background(session):
+    """Check for SMS once. Returns seconds until the next poll, or None when done."""
+    session_id = session.key
+    country_id = session.params["country_id"]
+    phone_number = session.params["phone_number"]
+    seen_messages = session.params["seen"]
+
+    if not owns_session(session_id):
+        return None
+
+    # Pause while the provider's circuit is open
+    if virtual_number_api.breaker.retry_after():
+        return circuit_delay(virtual_number_api, session)
+
+    # Come back at our booked slot instead of spending quota over the shared budget
+    if not session.params.pop("reserved", False):
+        wait = virtual_number_api.budget.reserve()
+        if wait:
+            session.params["reserved"] = True
+            return wait
+
+    try:
+        querystring = {"countryId": str(country_id), "number": phone_number}
+        
+        response = virtual_number_api.get("/api/v1/e-sim/view-messages", params=querystring,
+                                          endpoint="view_messages")
+        
+        if response.status_code == 429:
+            return throttled_delay(virtual_number_api, session)
+        if response.status_code == 200:
+            messages = response.json()
+            logger.debug("SMS polled", extra={"sample": "sms_poll", "session_id": session_id, "messages": messages})
+            if messages and isinstance(messages, list) and len(messages) > 0:
+                new_messages = []
+                for msg in messages:
+                    # The provider may not give SMS an id; fall back to its content
+                    msg_id = str(msg.get("id") or (msg.get("from"), msg.get("message"), msg.get("time")))
+                    if msg_id not in seen_messages:
+                        seen_messages.add(msg_id)
+                        new_messages.append(msg)
+
+                if new_messages:
+                    append_messages(session_id, new_messages)
+                    logger.info("New SMS received", extra={"phone_number": phone_number, "count": len(new_messages)})
+                    session.params["interval"] = POLL_MIN_INTERVAL
+        return next_interval(session)
+    except CircuitOpen:
+        return circuit_delay(virtual_number_api, session)
+    except requests.RequestException as e:
+        logger.warning("SMS poll failed", extra={"session_id": session_id, "error": str(e)})
+        return next_interval(session)
+    except Exception as e:
+        logger.exception("Error while polling SMS", extra={"session_id": session_id})
+        finish_session(session_id, "error", str(e))
+        return None
+
+def sms_timeout(session):
+    # If no SMS after timeout
+    finish_session(session.key, "timeout", "No SMS received after 5 minutes")
+
+# One engine polls every session; no thread per session
+poll_engine = PollEngine(workers=int(os.getenv("POLL_WORKERS", 16)))
+poll_engine.register("email", poll_inbox, inbox_timeout, release_slot)
+poll_engine.register("sms", poll_sms_background, sms_timeout, sms_done)
+
+# Cached per-country number lists
+number_catalog = NumberCatalog(fetch_country_numbers, NUMBER_CATALOG_TTL, NUMBER_CATALOG_REFRESH)
+
+# Ready-made addresses so /generate/email does not wait on the provider
+email_pool = EmailPool(generate_temp_email, EMAIL_POOL_LOW, EMAIL_POOL_HIGH, EMAIL_POOL_MAX_AGE)
+
+# ------------------- SERVICE API ------------------- #
+# Shared by the Flask routes and the in-process bot client. Every call
+# returns a (payload, status_code) pair, mirroring the HTTP responses.
+
+def admit(user, count=1, wait=0, per_user=None):
+    """Reserve ``count`` session slots for ``user``. Returns None, or the (payload, status) to answer with."""
+    per_user = admission.per_user if per_user is None else per_user
+    if per_user and count > per_user:
+        # Retrying would never help, so this is not a 429
+        return {"error": f"At most {per_user} sessions can be active per client", "per_user": per_user}, 400
+    try:
+        admission.acquire(user, count, wait, per_user)
+        return None
+    except Rejected as e:
+        ADMISSION_REJECTED.inc(e.reason)
+        logger.warning("Session request rejected", extra={"user": user, "reason": e.reason, "count": count})
+        if e.reason == "user_limit":
+            return {"error": "Too many active sessions for this client", "retry_after": e.retry_after}, 429
+        return {"error": "Service is at capacity, try again shortly", "retry_after": e.retry_after}, 503
+
+def provider_unavailable(e):
+    """The (payload, status) for a call refused by an open provider circuit."""
+    return {"error": "Provider is unavailable, try again shortly", "provider": e.provider,
+            "retry_after": math.ceil(e.retry_after)}, 503
+
+def start_sessions(sessions):
+    """Register new sessions in one pass: cache entries, status, ownership, then the poll engine.
+
+    ``sessions`` holds (key, kind, params, timeout, message) tuples. Each
+    one takes over an admission slot acquired for ``params["user"]``,
+    which the poll engine frees when the session ends.
+    """
+    for key, _, params, _, _ in sessions:
+        admission.bind(key, params["user"])
+    message_cache.set_many((key, pending_entry(message)) for key, _, _, _, message in sessions)
+    operation_status.set_many((key, "waiting") for key, *_ in sessions)
+    for key, *_ in sessions:
+        notifier.publish(key)
+    state.claim_many([key for key, *_ in sessions], owner_id(), POLL_LEASE)
+    poll_engine.schedule_many([(key, kind, params, timeout) for key, kind, params, timeout, _ in sessions])
+
+def email_session(temp_email, user):
+    return (temp_email, "email", {"seen": set(), "user": user}, EMAIL_POLL_TIMEOUT, "Waiting for emails...")
+
+def sms_session(country_id, number, user):
+    # Create a unique session ID for this request
+    session_id = f"sms_{country_id}_{number}_{int(time.time())}_{secrets.token_hex(3)}"
+    params = {"country_id": country_id, "phone_number": number, "seen": set(), "user": user}
+    return (session_id, "sms", params, SMS_POLL_TIMEOUT, "Waiting for SMS...")
+
+def create_email_session(user=None, wait=0):
+    rejected = admit(user, wait=wait)
+    if rejected:
+        return rejected
+    try:
+        temp_email = email_pool.acquire() or generate_temp_email()
+    except CircuitOpen as e:
+        admission.cancel(user)
+        return provider_unavailable(e)
+    if not temp_email:
+        admission.cancel(user)
+        return {"error": "Failed to create temporary email"}, 500
+
+    # Initialize the cache entry and hand the session to the poll engine
+    start_sessions([email_session(temp_email, user)])
+    return {"temp_email": temp_email}, 200
+
+def get_email_messages(temp_email, wait=0, since=0, view="full"):
+    if view not in VIEWS:
+        return {"error": f"view must be one of {', '.join(VIEWS)}"}, 400
+    entry = message_cache.get(temp_email)
+    if entry is not None and wait > 0:
+        entry = wait_for_result(temp_email, wait, since)
+    # None also when the entry expired or was evicted during the wait
+    if entry is not None:
+        return session_view(entry, since, view), 200
+    else:
+        return {"error": "Email not found"}, 404
+
+def create_number_session(country_id, user=None, wait=0):
+    rejected = admit(user, wait=wait)
+    if rejected:
+        return rejected
+    try:
+        number = generate_virtual_phone_number(country_id)
+    except CircuitOpen as e:
+        admission.cancel(user)
+        return provider_unavailable(e)
+    if number:
+        session = sms_session(country_id, number, user)
+        session_id = session[0]
+
+        # Initialize cache for this session and hand it to the poll engine
+        start_sessions([session])
+
+        return {
+            "virtual_phone": number,
+            "country_id": country_id,
+            "session_id": session_id
+        }, 200
+    else:
+        admission.cancel(user)
+        return {"error": "Could not generate virtual phone number"}, 500
+
+def get_sms_status(session_id, wait=0, since=0, view="full"):
+    if view not in VIEWS:
+        return {"error": f"view must be one of {', '.join(VIEWS)}"}, 400
+    entry = message_cache.get(session_id)
+    if entry is not None and wait > 0:
+        entry = wait_for_result(session_id, wait, since)
+    # None also when the entry expired or was evicted during the wait
+    if entry is not None:
+        return session_view(entry, since, view), 200
+    else:
+        return {"error": "Session not found"}, 404
+
+def cancel_operation(operation_id):
+    if operation_id in operation_status:
+        entry = message_cache.get(operation_id)
+        if entry is None or entry.get("done"):
+            # Already finished: keep its final state and do not count the outcome twice
+            return {"status": (entry or {}).get("status", operation_status.get(operation_id))}, 200
+        operation_status[operation_id] = "cancelled"
+        poll_engine.cancel(operation_id)
+        finish_session(operation_id, "cancelled", "Operation was cancelled by user")
+        return {"status": "cancelled"}, 200
+    return {"error": "Operation not found"}, 404
+
+def wait_for_result(key, wait, since=0):
+    """Long-poll: block up to ``wait`` seconds until messages past ``since`` arrive or the session ends."""
+    deadline = time.time() + min(wait, MAX_LONG_POLL)
+    with notifier.watch(key) as changed:
+        entry = message_cache.get(key)
+        while entry is not None and not is_settled(entry, since):
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            # Re-read periodically too, in case another worker stored the result
+            changed.wait(min(remaining, NOTIFY_RECHECK))
+            changed.clear()
+            entry = message_cache.get(key)
+    return entry
+
+def iter_updates(key, since=0):
+    """Yield a session's state, with only new messages, each time it changes.
+
+    Yields None as a keep-alive. Ends once the session is done or
+    SSE_MAX_DURATION passes.
+    """
+    deadline = time.time() + SSE_MAX_DURATION
+    last_entry = None
+    last_sent = 0
+    with notifier.watch(key) as changed:
+        while time.time() < deadline:
+            entry = message_cache.get(key)
+            if entry is None:
+                return
+            if entry != last_entry:
+                yield session_view(entry, since)
+                since = entry.get("cursor", 0)
+                last_entry = entry
+                last_sent = time.time()
+                if entry.get("done", True):
+                    return
+            elif time.time() - last_sent >= SSE_KEEPALIVE:
+                yield None
+                last_sent = time.time()
+            changed.wait(min(NOTIFY_RECHECK, SSE_KEEPALIVE))
+            changed.clear()
+
+def get_quota():
+    return {
+        "temp_mail": temp_mail_api.budget.usage(),
+        "virtual_number": virtual_number_api.budget.usage(),
+    }, 200
+
+def get_health():
+    """Circuit breaker state per provider. "degraded" while any circuit is not closed."""
+    providers = {name: api.breaker.status() for name, api in PROVIDERS.items()}
+    degraded = any(provider["state"] != "closed" for provider in providers.values())
+    return {"status": "degraded" if degraded else "ok", "providers": providers}, 200
+
+def get_stats():
+    return {
+        "message_cache": message_cache.stats(),
+        "operation_status": operation_status.stats(),
+        "active_pollers": poll_engine.active_count(),
+        "admission": admission.usage(),
+        "waiters": notifier.waiter_count(),
+        "email_pool": email_pool.stats(),
+        "number_catalog": number_catalog.stats(),
+        "singleflight": {
+            "temp_mail": temp_mail_api.flights.stats(),
+            "virtual_number": virtual_number_api.flights.stats(),
+        },
+    }, 200
+
+# ------------------- BATCH API ------------------- #
+# Provider calls for batch requests fan out on this pool; its size caps
+# how many are in flight at once across every batch
+batch_pool = ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY, thread_name_prefix="batch")
+
+def batch_size_error(count):
+    """Error payload for an out-of-range batch size, or None if it is fine."""
+    if not isinstance(count, int) or isinstance(count, bool) or not 1 <= count <= BATCH_MAX_ITEMS:
+        return {"error": f"Batch size must be between 1 and {BATCH_MAX_ITEMS}"}
+    return None
+
+def fan_out(fn, args):
+    """Run ``fn`` over ``args`` on the batch pool. Returns (result, error) pairs in order."""
+    futures = [batch_pool.submit(fn, arg) for arg in args]
+    results = []
+    for future in futures:
+        try:
+            results.append((future.result(), None))
+        except Exception as e:
+            logger.warning("Batch item failed", extra={"error": str(e)})
+            results.append((None, str(e)))
+    return results
+
+def batch_response(items, sessions, user):
+    """Register the created sessions together, hand back unused slots and summarize the batch."""
+    if sessions:
+        start_sessions(sessions)
+    if len(items) > len(sessions):
+        admission.cancel(user, len(items) - len(sessions))
+    created = len(sessions)
+    payload = {"requested": len(items), "created": created, "failed": len(items) - created, "items": items}
+    return payload, 200 if created else 500
+
+def create_email_batch(count, user=None, wait=0):
+    """Create ``count`` email sessions, calling the provider concurrently. Failed items carry an error."""
+    error = batch_size_error(count)
+    if error:
+        return error, 400
+    rejected = admit(user, count, wait, ADMISSION_BATCH_PER_USER)
+    if rejected:
+        return rejected
+    # Take what the pre-warmed pool has, then create the rest in parallel
+    addresses = [email_pool.acquire() for _ in range(min(count, email_pool.size()))]
+    addresses = [address for address in addresses if address]
+    results = [(address, None) for address in addresses]
+    results += fan_out(lambda _: generate_temp_email(), range(count - len(addresses)))
+
+    items, sessions = [], []
+    for index, (temp_email, error) in enumerate(results):
+        if temp_email:
+            items.append({"index": index, "temp_email": temp_email})
+            sessions.append(email_session(temp_email, user))
+        else:
+            items.append({"index": index, "error": error or "Failed to create temporary email"})
+    return batch_response(items, sessions, user)
+
+def create_number_batch(country_ids, user=None, wait=0):
+    """Create one SMS session per entry of ``country_ids``, leasing numbers concurrently."""
+    if not isinstance(country_ids, list):
+        return {"error": "country_ids must be a list"}, 400
+    error = batch_size_error(len(country_ids))
+    if error:
+        return error, 400
+    rejected = admit(user, len(country_ids), wait, ADMISSION_BATCH_PER_USER)
+    if rejected:
+        return rejected
+    country_ids = [str(country_id) for country_id in country_ids]
+    results = fan_out(generate_virtual_phone_number, country_ids)
+
+    items, sessions = [], []
+    for index, (country_id, (number, error)) in enumerate(zip(country_ids, results)):
+        if number:
+            session = sms_session(country_id, number, user)
+            sessions.append(session)
+            items.append({"index": index, "virtual_phone": number, "country_id": country_id,
+                          "session_id": session[0]})
+        else:
+            items.append({"index": index, "country_id": country_id,
+                          "error": error or "Could not generate virtual phone number"})
+    return batch_response(items, sessions, user)
+
+def get_session_states(keys, since=None, view="full"):
+    """Current state of many email or SMS sessions. ``since`` maps a key to the cursor the client holds."""
+    if not isinstance(keys, list) or not all(isinstance(key, str) for key in keys):
+        return {"error": "keys must be a list of strings"}, 400
+    if view not in VIEWS:
+        return {"error": f"view must be one of {', '.join(VIEWS)}"}, 400
+    error = batch_size_error(len(keys))
+    if error:
+        return error, 400
+    since = since if isinstance(since, dict) else {}
+    cursors = {}
+    for key in keys:
+        cursor = since.get(key) or 0
+        if not isinstance(cursor, int) or isinstance(cursor, bool) or cursor < 0:
+            return {"error": "since values must be non-negative integers"}, 400
+        cursors[key] = cursor
+    entries = message_cache.get_many(keys)
+    return {
+        "sessions": {key: session_view(entry, cursors[key], view) for key, entry in entries.items()},
+        "missing": [key for key in keys if key not in entries],
+    }, 200
+
+# ------------------- WARM RESTART ------------------- #
+# Seconds over which resumed sessions spread their first poll after a restart
+RESUME_SPREAD = float(os.getenv("RESUME_SPREAD", 10))
+
+def export_sessions():
+    """Snapshot every active poll session as JSON-ready data for a warm restart."""
+    sessions = []
+    for session in poll_engine.sessions():
+        params = {k: v for k, v in session.params.items() if k != "reserved"}
+        params["seen"] = sorted(params.get("seen", ()))
+        sessions.append({
+            "key": session.key,
+            "kind": session.kind,
+            "params": params,
+            "deadline": session.deadline,
+            "entry": message_cache.get(session.key),
+            "status": operation_status.get(session.key),
+        })
+    return sessions
+
+def import_sessions(sessions):
+    """Resume sessions from ``export_sessions`` with their remaining deadlines. Returns the count resumed."""
+    resumed = 0
+    now = time.time()
+    for item in sessions:
+        key = item["key"]
+        # The shared backend may already hold newer state than the checkpoint
+        if key not in message_cache and item.get("entry") is not None:
+            message_cache[key] = item["entry"]
+        if key not in operation_status and item.get("status") is not None:
+            operation_status[key] = item["status"]
+        entry = message_cache.get(key) or {}
+        if entry.get("done") or operation_status.get(key) == "cancelled":
+            continue
+        if not state.claim(key, owner_id(), POLL_LEASE):
+            continue  # another live worker already took it over
+        params = dict(item["params"], seen=set(item["params"].get("seen", ())))
+        # A session past its deadline times out on its first step
+        poll_engine.schedule(key, item["kind"], params, max(item["deadline"] - now, 0),
+                             delay=random.uniform(0, RESUME_SPREAD))
+        admission.occupy(key, params.get("user"))
+        resumed += 1
+    return resumed
+
+def drain_sessions():
+    """Stop polling, snapshot the sessions and hand their ownership back for the next process."""
+    poll_engine.stop(wait=True)
+    sessions = export_sessions()
+    for item in sessions:
+        state.release(item["key"], owner_id())
+    return sessions
+
+# ------------------- METRICS ------------------- #
+registry.gauge("tempgen_active_pollers", "Sessions scheduled on the poll engine", poll_engine.active_count)
+registry.gauge("tempgen_admission_in_flight", "Sessions holding an admission slot",
+               lambda: admission.usage()["in_flight"])
+registry.gauge("tempgen_admission_waiting", "Requests queued for an admission slot",
+               lambda: admission.usage()["waiting"])
+registry.gauge("tempgen_session_waiters", "Long-poll and SSE clients waiting on a session", notifier.waiter_count)
+registry.gauge("tempgen_store_entries", "Entries held per session store",
+               lambda: {("message_cache",): len(message_cache), ("operation_status",): len(operation_status)},
+               ("store",))
@@ -0,0 +1,231 @@
+# startup.py (Cold Start)
+"""Background warm-up, readiness and webhook registration.
+
+Run ``python startup.py`` for an import-time profile of the web service.
+"""
+import argparse
+import logging
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlparse
+from dotenv import load_dotenv
+from metrics import registry
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Load startup settings
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # registered in the background when set
+WEBHOOK_ATTEMPTS = int(os.getenv("WEBHOOK_ATTEMPTS", 5))  # tries before giving up on registration
+TELEGRAM_ATTEMPTS = int(os.getenv("TELEGRAM_ATTEMPTS", 8))  # getMe tries before the warm-up gives up
+
+# Modules the warm-up imports after the server is already accepting connections
+WARM_UP_MODULES = ("bot", "checkpoint")
+
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)")
+
+
+class WarmUp:
+    """Runs named startup steps on a background thread and records how long each took.
+
+    The process can accept connections while heavy imports, the dispatcher
+    and checkpoint resume are still loading; ``ready`` is set once every
+    step finished. The readiness endpoint also requires every check added
+    with ``add_check`` to pass, for parts that can fail after start-up.
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.phases = {}
+        self.error = None
+        self.ready = threading.Event()
+        self.done = threading.Event()
+        self.checks = {}
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self, steps):
+        """Run ``steps`` (a list of (name, fn) pairs) in order. Idempotent."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, args=(steps,), name="warm-up", daemon=True)
+                self._thread.start()
+
+    def add_check(self, name, fn):
+        """Require ``fn()`` to be true for the worker to stay ready."""
+        self.checks[name] = fn
+
+    def is_ready(self):
+        return self.ready.is_set() and all(self._run_checks().values())
+
+    def _run_checks(self):
+        results = {}
+        for name, fn in list(self.checks.items()):
+            try:
+                results[name] = bool(fn())
+            except Exception:
+                results[name] = False
+        return results
+
+    def wait(self, timeout=None):
+        """Block until the warm-up finished or failed. Returns True if it is ready."""
+        self.done.wait(timeout)
+        return self.ready.is_set()
+
+    def status(self):
+        checks = self._run_checks()
+        return {
+            "ready": self.ready.is_set() and all(checks.values()),
+            "uptime": round(time.monotonic() - self.started, 3),
+            "phases": dict(self.phases),
+            "checks": checks,
+            "error": self.error,
+        }
+
+    def _run(self, steps):
+        try:
+            self._steps(steps)
+        finally:
+            self.done.set()
+
+    def _steps(self, steps):
+        for name, fn in steps:
+            began = time.monotonic()
+            try:
+                fn()
+            except Exception as e:
+                # Stay unready so the platform keeps traffic on the previous instance
+                self.error = f"{name}: {e}"
+                logger.exception("Warm-up step failed", extra={"phase": name})
+                return
+            self.phases[name] = round(time.monotonic() - began, 3)
+        self.phases["total"] = round(time.monotonic() - self.started, 3)
+        self.ready.set()
+        logger.info("Warm-up finished", extra=self.phases)
+
+
+warm_up = WarmUp()
+
+registry.gauge("tempgen_ready", "1 while the worker is warmed up and its checks pass",
+               lambda: int(warm_up.is_ready()))
+registry.gauge("tempgen_startup_seconds", "Seconds spent in each warm-up phase",
+               lambda: {(name,): seconds for name, seconds in warm_up.phases.items()}, ("phase",))
+
+
+def readiness():
+    """Warm-up state for the readiness endpoint: 200 once ready, 503 before."""
+    payload = warm_up.status()
+    return payload, 200 if payload["ready"] else 503
+
+
+# ------------------- TELEGRAM ------------------- #
+def wait_for_telegram(bot, attempts=TELEGRAM_ATTEMPTS):
+    """Fetch the bot's identity (getMe), retrying with backoff. Raises the last error after ``attempts``."""
+    for attempt in range(attempts):
+        try:
+            return bot.get_me()
+        except Exception:
+            if attempt == attempts - 1:
+                raise
+            logger.warning("Telegram not reachable", exc_info=True, extra={"attempt": attempt + 1})
+            time.sleep(min(2 ** attempt, 30))
+
+
+# ------------------- WEBHOOK REGISTRATION ------------------- #
+def webhook_target(url):
+    """The URL Telegram should post to; a bare host gets the /webhook route appended."""
+    if not url:
+        return None
+    if urlparse(url).path in ("", "/"):
+        url = url.rstrip("/") + "/webhook"
+    return url
+
+
+def register_webhook(bot, url):
+    """Point the bot's webhook at ``url`` unless it already is. Returns True if it changed."""
+    current = bot.get_webhook_info().url
+    if current == url:
+        logger.info("Webhook already registered", extra={"url": url})
+        return False
+    bot.set_webhook(url)
+    logger.info("Webhook registered", extra={"url": url, "previous": current or None})
+    return True
+
+
+def register_webhook_async(get_bot, url=WEBHOOK_URL, attempts=WEBHOOK_ATTEMPTS):
+    """Register the webhook on a background thread, retrying with backoff."""
+    url = webhook_target(url)
+    if url is None:
+        return None
+
+    def run():
+        for attempt in range(attempts):
+            try:
+                register_webhook(get_bot(), url)
+                return
+            except Exception:
+                logger.warning("Webhook registration failed", exc_info=True,
+                               extra={"url": url, "attempt": attempt + 1})
+                time.sleep(min(2 ** attempt, 30))
+        logger.error("Giving up on webhook registration", extra={"url": url})
+
+    thread = threading.Thread(target=run, name="webhook-register", daemon=True)
+    thread.start()
+    return thread
+
+
+# ------------------- IMPORT PROFILE ------------------- #
+def import_profile(module="main"):
+    """Import ``module``, then the warm-up modules, in a fresh interpreter with ``-X importtime``.
+
+    The warm-up thread is not started, so its imports do not interleave
+    with the main thread's. Returns (name, self_seconds,
+    cumulative_seconds, depth) tuples in import order.
+    """
+    env = dict(os.environ, CHECKPOINT_DIR="", WEBHOOK_URL="")
+    script = (f"import startup; startup.warm_up.start = lambda steps: None; "
+              f"import {module}; import {', '.join(WARM_UP_MODULES)}")
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", script],
+                            cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                            capture_output=True, text=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            rows.append((match.group(4), int(match.group(1)) / 1e6, int(match.group(2)) / 1e6,
+                         len(match.group(3)) // 2))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-time profile of the web service")
+    parser.add_argument("--module", default="main", help="module to import (default: main)")
+    parser.add_argument("--top", type=int, default=20, help="rows to show")
+    parser.add_argument("--warm-up", action="store_true", help="also time the background warm-up")
+    args = parser.parse_args()
+
+    rows = import_profile(args.module)
+    top_level = {name: cumulative for name, _, cumulative, depth in rows if depth == 0}
+    deferred = sum(top_level.get(name, 0) for name in WARM_UP_MODULES)
+    print(f"import {args.module} (before serving): {top_level.get(args.module, 0) * 1000:.0f} ms")
+    print(f"warm-up imports ({', '.join(WARM_UP_MODULES)}): {deferred * 1000:.0f} ms")
+    print(f"{'cumulative ms':>14} {'self ms':>8}  module")
+    for name, own, cumulative, depth in sorted(rows, key=lambda row: -row[2])[:args.top]:
+        print(f"{cumulative * 1000:14.1f} {own * 1000:8.1f}  {'  ' * depth}{name}")
+
+    if args.warm_up:
+        os.environ.update(CHECKPOINT_DIR="", WEBHOOK_URL="")
+        began = time.monotonic()
+        __import__(args.module)
+        # The app started the warm-up of the imported module, not of this script
+        status = sys.modules["startup"].warm_up
+        status.wait(60)
+        print(f"ready after {(time.monotonic() - began) * 1000:.0f} ms: {status.status()}")
+
+
+if __name__ == "__main__":
+    main()
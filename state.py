@@ -0,0 +1,278 @@
+# state.py (Session State Backends)
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from store import SessionStore
+
+load_dotenv()
+
+# "memory" keeps state in this process; "sqlite" shares it between workers on one node
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory")
+STATE_DB_PATH = os.getenv("STATE_DB_PATH", "tempgen-state.db")
+SESSION_TTL = int(os.getenv("SESSION_TTL", 3600))                      # seconds after last update
+SESSION_MAX_ENTRIES = int(os.getenv("SESSION_MAX_ENTRIES", 50000))
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", 64 * 1024 * 1024))
+
+_MISSING = object()
+
+
+def os_thread_local():
+    """A threading.local keyed on the OS thread, even where gevent has made threading.local per greenlet."""
+    try:
+        from gevent import monkey
+    except ImportError:
+        return threading.local()
+    return monkey.get_original("threading", "local")()
+
+
+def owner_id():
+    """Identify this worker process when claiming sessions (computed after fork)."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class MemoryBackend:
+    """Default backend: bounded in-process session stores."""
+
+    shared = False  # state is private to this worker process
+
+    def __init__(self):
+        self._owners = {}
+        self._owners_lock = threading.Lock()
+
+    def mapping(self, name):
+        return SessionStore(SESSION_MAX_ENTRIES, SESSION_MAX_BYTES, SESSION_TTL)
+
+    def claim(self, key, owner, lease):
+        """Take or renew ownership of ``key``; False if another live owner holds it."""
+        now = time.time()
+        with self._owners_lock:
+            current = self._owners.get(key)
+            if current and current[0] != owner and current[1] > now:
+                return False
+            self._owners[key] = (owner, now + lease)
+            return True
+
+    def claim_many(self, keys, owner, lease):
+        """Claim several keys at once. Returns the keys now owned by ``owner``."""
+        return {key for key in keys if self.claim(key, owner, lease)}
+
+    def release(self, key, owner):
+        with self._owners_lock:
+            current = self._owners.get(key)
+            if current and current[0] == owner:
+                del self._owners[key]
+
+
+class SqliteBackend:
+    """Shared backend for several worker processes on one node (SQLite in WAL mode)."""
+
+    shared = True
+
+    def __init__(self, path):
+        self.path = path
+        # One connection per OS thread, shared by its greenlets. SQLite calls never
+        # yield to the gevent hub, so a transaction cannot interleave with another.
+        self._local = os_thread_local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv ("
+            " ns TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, expires_at REAL NOT NULL,"
+            " PRIMARY KEY (ns, key)) WITHOUT ROWID"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS owners ("
+            " key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL) WITHOUT ROWID"
+        )
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        # Connections must not cross a fork, so reconnect in a new worker process
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """Run the block in one write transaction: committed if it completes, rolled back if it raises."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def mapping(self, name):
+        return SqliteMapping(self, name, SESSION_TTL)
+
+    def claim(self, key, owner, lease):
+        """Take or renew ownership of ``key``; False if another live owner holds it."""
+        now = time.time()
+        cursor = self._conn().execute(
+            "INSERT INTO owners (key, owner, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+            "WHERE owners.owner = excluded.owner OR owners.expires_at <= ?",
+            (str(key), owner, now + lease, now),
+        )
+        return cursor.rowcount == 1
+
+    def claim_many(self, keys, owner, lease):
+        """Claim several keys in one transaction. Returns the keys now owned by ``owner``."""
+        with self.transaction():
+            return {key for key in keys if self.claim(key, owner, lease)}
+
+    def release(self, key, owner):
+        self._conn().execute("DELETE FROM owners WHERE key = ? AND owner = ?", (str(key), owner))
+
+
+class SqliteMapping:
+    """Dict-like view of one namespace in a SqliteBackend. Values are stored as JSON."""
+
+    def __init__(self, backend, name, ttl, sweep_interval=60):
+        self.backend = backend
+        self.name = name
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self._next_sweep = time.time() + sweep_interval
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+
+    def set(self, key, value, ttl=None):
+        now = time.time()
+        conn = self.backend._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO kv (ns, key, value, expires_at) VALUES (?, ?, ?, ?)",
+            (self.name, str(key), json.dumps(value), now + (self.ttl if ttl is None else ttl)),
+        )
+        self._maybe_sweep(conn, now)
+
+    def add(self, key, value, ttl=None):
+        """Store ``value`` only if ``key`` is absent or expired, atomically across workers. True if stored."""
+        now = time.time()
+        conn = self.backend._conn()
+        cursor = conn.execute(
+            "INSERT INTO kv (ns, key, value, expires_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(ns, key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at "
+            "WHERE kv.expires_at <= ?",
+            (self.name, str(key), json.dumps(value), now + (self.ttl if ttl is None else ttl), now),
+        )
+        self._maybe_sweep(conn, now)
+        return cursor.rowcount == 1
+
+    def _maybe_sweep(self, conn, now):
+        if now >= self._next_sweep:
+            self._next_sweep = now + self.sweep_interval
+            cursor = conn.execute("DELETE FROM kv WHERE ns = ? AND expires_at <= ?", (self.name, now))
+            self.expirations += max(cursor.rowcount, 0)
+
+    def set_many(self, items, ttl=None):
+        """Write several (key, value) pairs in one transaction."""
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        rows = [(self.name, str(key), json.dumps(value), expires_at) for key, value in items]
+        with self.backend.transaction() as conn:
+            conn.executemany("INSERT OR REPLACE INTO kv (ns, key, value, expires_at) VALUES (?, ?, ?, ?)", rows)
+
+    def get_many(self, keys):
+        """Return {key: value} for the keys that are present, reading them in a few queries."""
+        by_name = {str(key): key for key in keys}
+        names = list(by_name)
+        found = {}
+        conn = self.backend._conn()
+        for start in range(0, len(names), 500):  # stay under SQLite's bound-parameter limit
+            chunk = names[start:start + 500]
+            rows = conn.execute(
+                f"SELECT key, value FROM kv WHERE ns = ? AND expires_at > ? AND key IN ({','.join('?' * len(chunk))})",
+                (self.name, time.time(), *chunk),
+            ).fetchall()
+            for name, value in rows:
+                found[by_name[name]] = json.loads(value)
+        self.hits += len(found)
+        self.misses += len(names) - len(found)
+        return found
+
+    def get(self, key, default=None):
+        row = self.backend._conn().execute(
+            "SELECT value FROM kv WHERE ns = ? AND key = ? AND expires_at > ?",
+            (self.name, str(key), time.time()),
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return json.loads(row[0])
+
+    def pop(self, key, default=None):
+        with self.backend.transaction() as conn:
+            value = self.get(key, _MISSING)
+            conn.execute("DELETE FROM kv WHERE ns = ? AND key = ?", (self.name, str(key)))
+        return default if value is _MISSING else value
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __delitem__(self, key):
+        if self.pop(key, _MISSING) is _MISSING:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        row = self.backend._conn().execute(
+            "SELECT 1 FROM kv WHERE ns = ? AND key = ? AND expires_at > ?",
+            (self.name, str(key), time.time()),
+        ).fetchone()
+        return row is not None
+
+    def __len__(self):
+        return self.backend._conn().execute(
+            "SELECT COUNT(*) FROM kv WHERE ns = ? AND expires_at > ?", (self.name, time.time())
+        ).fetchone()[0]
+
+    def items(self):
+        """Snapshot of the live (key, value) pairs. Keys come back as strings."""
+        rows = self.backend._conn().execute(
+            "SELECT key, value FROM kv WHERE ns = ? AND expires_at > ?", (self.name, time.time())
+        ).fetchall()
+        return [(key, json.loads(value)) for key, value in rows]
+
+    def stats(self):
+        return {
+            "entries": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": 0,
+            "expirations": self.expirations,
+        }
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_backend():
+    """Return the process-wide state backend selected by STATE_BACKEND."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if STATE_BACKEND == "sqlite":
+                    _backend = SqliteBackend(STATE_DB_PATH)
+                elif STATE_BACKEND == "memory":
+                    _backend = MemoryBackend()
+                else:
+                    raise ValueError(f"Unknown STATE_BACKEND: {STATE_BACKEND}")
+    return _backend
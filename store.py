@@ -0,0 +1,160 @@
+# store.py (Session Store)
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+def estimate_size(value):
+    """Rough byte size of a JSON-like value; cheap enough to run on every write."""
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(estimate_size(k) + estimate_size(v) for k, v in value.items()) + 64
+    if isinstance(value, (list, tuple, set)):
+        return sum(estimate_size(v) for v in value) + 56
+    return 16
+
+
+class SessionStore:
+    """Thread-safe dict-like store with per-entry TTL and LRU eviction.
+
+    Entries expire ``ttl`` seconds after they were last written. When the
+    entry count or the estimated byte size exceeds its budget, the least
+    recently used entries are evicted. Lookups are O(1); expired entries are
+    dropped lazily on access and by a periodic sweep.
+    """
+
+    def __init__(self, max_entries=50000, max_bytes=64 * 1024 * 1024, ttl=3600, sweep_interval=60):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self._data = OrderedDict()  # key -> (value, expires_at, size)
+        self._lock = threading.RLock()
+        self._bytes = 0
+        self._next_sweep = time.monotonic() + sweep_interval
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def set(self, key, value, ttl=None):
+        size = estimate_size(key) + estimate_size(value)
+        now = time.monotonic()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._data[key] = (value, expires_at, size)
+            self._bytes += size
+            if now >= self._next_sweep:
+                self._sweep(now)
+            while self._data and (len(self._data) > self.max_entries or self._bytes > self.max_bytes):
+                _, (_, _, evicted_size) = self._data.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def add(self, key, value, ttl=None):
+        """Store ``value`` only if ``key`` is absent or expired. Returns True if it was stored."""
+        with self._lock:
+            if key in self:
+                return False
+            self.set(key, value, ttl)
+            return True
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            if entry[1] <= time.monotonic():
+                self._expire(key, entry)
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set_many(self, items, ttl=None):
+        """Write several (key, value) pairs under one lock acquisition."""
+        with self._lock:
+            for key, value in items:
+                self.set(key, value, ttl)
+
+    def get_many(self, keys):
+        """Return {key: value} for the keys that are present."""
+        found = {}
+        with self._lock:
+            for key in keys:
+                value = self.get(key, _MISSING)
+                if value is not _MISSING:
+                    found[key] = value
+        return found
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None:
+                return default
+            self._bytes -= entry[2]
+            return entry[0] if entry[1] > time.monotonic() else default
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __delitem__(self, key):
+        if self.pop(key, _MISSING) is _MISSING:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return False
+            if entry[1] <= time.monotonic():
+                self._expire(key, entry)
+                return False
+            return True
+
+    def __len__(self):
+        return len(self._data)
+
+    def items(self):
+        """Snapshot of the live (key, value) pairs."""
+        now = time.monotonic()
+        with self._lock:
+            return [(key, entry[0]) for key, entry in self._data.items() if entry[1] > now]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+    def _expire(self, key, entry):
+        del self._data[key]
+        self._bytes -= entry[2]
+        self.expirations += 1
+
+    def _sweep(self, now):
+        expired = [(key, entry) for key, entry in self._data.items() if entry[1] <= now]
+        for key, entry in expired:
+            self._expire(key, entry)
+        self._next_sweep = now + self.sweep_interval
@@ -0,0 +1,107 @@
+# upstream.py (Upstream HTTP client)
+import os
+import random
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from breaker import CircuitBreaker, CircuitOpen
+from metrics import registry
+from ratelimit import RateBudget, parse_retry_after
+from singleflight import SingleFlight
+
+# Load client settings
+CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", 3.05))
+READ_TIMEOUT = float(os.getenv("UPSTREAM_READ_TIMEOUT", 10))
+POOL_SIZE = int(os.getenv("UPSTREAM_POOL_SIZE", 32))
+MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", 2))
+BACKOFF_FACTOR = float(os.getenv("UPSTREAM_BACKOFF_FACTOR", 0.3))
+
+# Circuit breaker per provider: open once FAILURE_RATE of the last WINDOW calls failed
+BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", 20))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", 5))             # calls needed before it can open
+BREAKER_FAILURE_RATE = float(os.getenv("BREAKER_FAILURE_RATE", 0.5))
+BREAKER_SLOW_CALL = float(os.getenv("BREAKER_SLOW_CALL", 5))           # seconds; slower calls count as failures
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", 30))    # fail fast this long before probing
+
+UPSTREAM_LATENCY = registry.histogram(
+    "tempgen_upstream_request_seconds", "Upstream provider call latency", ("endpoint",))
+UPSTREAM_RESPONSES = registry.counter(
+    "tempgen_upstream_responses_total", "Upstream provider responses by status code", ("endpoint", "code"))
+
+
+class JitterRetry(Retry):
+    """Exponential backoff with up to 100% random jitter added to each wait."""
+
+    def get_backoff_time(self):
+        backoff = super().get_backoff_time()
+        return backoff + random.uniform(0, backoff) if backoff else 0
+
+
+class UpstreamClient:
+    """Keep-alive HTTP client for one provider host.
+
+    Connections are pooled per client, every request gets connect and read
+    timeouts, and idempotent requests are retried on connection errors and
+    502/503/504 responses. Every response is counted against the client's
+    shared RateBudget, and a 429 pauses the budget for its Retry-After.
+    Concurrent identical GETs are coalesced into a single request.
+    A CircuitBreaker named ``name`` refuses calls with CircuitOpen while
+    the provider is failing. Calls are timed per ``endpoint`` name for the
+    /metrics histograms.
+    """
+
+    def __init__(self, base_url, headers, rate=5, burst=10, name="upstream"):
+        self.base_url = base_url.rstrip("/")
+        self.budget = RateBudget(rate, burst)
+        self.breaker = CircuitBreaker(name, BREAKER_WINDOW, BREAKER_MIN_CALLS, BREAKER_FAILURE_RATE,
+                                      BREAKER_SLOW_CALL, BREAKER_OPEN_SECONDS)
+        self.flights = SingleFlight()
+        self.timeout = (CONNECT_TIMEOUT, READ_TIMEOUT)
+        self.session = requests.Session()
+        self.session.headers.update(headers)
+
+        retry = JitterRetry(
+            total=MAX_RETRIES,
+            backoff_factor=BACKOFF_FACTOR,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset({"GET"}),
+            respect_retry_after_header=False,  # 429s are rescheduled by the caller, not slept on
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def get(self, path, params=None, endpoint=None):
+        # Identical GETs already in flight share one upstream call
+        key = (path, tuple(sorted((params or {}).items())))
+        return self.flights.do(key, lambda: self.request("GET", path, endpoint=endpoint, params=params))
+
+    def post(self, path, endpoint=None, **kwargs):
+        return self.request("POST", path, endpoint=endpoint, **kwargs)
+
+    def request(self, method, path, endpoint=None, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        endpoint = endpoint or path
+        try:
+            probe = self.breaker.before()
+        except CircuitOpen:
+            UPSTREAM_RESPONSES.inc(endpoint, "circuit_open")
+            raise
+        started = time.perf_counter()
+        response = None
+        try:
+            response = self.session.request(method, self.base_url + path, **kwargs)
+        except requests.RequestException:
+            UPSTREAM_RESPONSES.inc(endpoint, "error")
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            UPSTREAM_LATENCY.observe(elapsed, endpoint)
+            self.breaker.record(response is not None and response.status_code < 500, elapsed, probe)
+        UPSTREAM_RESPONSES.inc(endpoint, response.status_code)
+        self.budget.record(response.status_code)
+        if response.status_code == 429:
+            self.budget.pause(parse_retry_after(response.headers.get("Retry-After")))
+        return response